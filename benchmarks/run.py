@@ -0,0 +1,416 @@
+"""Load-test the PixelDust hot paths and write the results as JSON.
+
+Starts the server against a throwaway database, seeds a user and some
+files, then runs each scenario with a fixed number of requests at a fixed
+concurrency:
+
+    python benchmarks/run.py --dsn postgresql://postgres@localhost/postgres \\
+        --concurrency 32 --requests 2000 --output results.json
+
+The database named in --dsn is only used to CREATE and DROP a fresh
+pixeldust_bench_* database; nothing in it is touched. Pass --compare with a
+previous results file to print the change per scenario and exit non-zero
+when one got slower than --max-regression.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import secrets
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import asyncpg
+import httpx
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+SCENARIOS = ("login", "upload", "img", "raw", "files", "export")
+
+
+def parse_sizes(spec: str) -> List[tuple]:
+    """"16k:0.6,256k:0.3,2m:0.1" -> [(16384, 0.6), (262144, 0.3), (2097152, 0.1)]"""
+    units = {"k": 1024, "m": 1024 * 1024}
+    sizes = []
+    for part in spec.split(","):
+        size, _, weight = part.partition(":")
+        size = size.strip().lower()
+        factor = units.get(size[-1], 1)
+        sizes.append((int(float(size.rstrip("km")) * factor), float(weight or 1)))
+    return sizes
+
+
+def make_png(size: int) -> bytes:
+    """A PNG of random pixels weighing roughly `size` bytes (noise does not compress)."""
+    side = max(8, int((size / 3) ** 0.5))
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class MemorySampler:
+    """Peak resident memory of a process and its children, read from /proc.
+
+    Only available on Linux; elsewhere `peak_mb` stays None.
+    """
+
+    def __init__(self, pid: Optional[int], interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _tree(self, pid: int) -> List[int]:
+        pids = [pid]
+        try:
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    for child in f.read().split():
+                        pids += self._tree(int(child))
+        except OSError:
+            pass
+        return pids
+
+    def rss(self) -> Optional[int]:
+        total = 0
+        for pid in self._tree(self.pid):
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            except (OSError, ValueError):
+                continue
+        return total or None
+
+    async def _run(self):
+        while True:
+            rss = self.rss()
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.pid is not None and sys.platform.startswith("linux"):
+            self.peak = None
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    @property
+    def peak_mb(self) -> Optional[float]:
+        return round(self.peak / (1024 * 1024), 1) if self.peak else None
+
+
+async def run_scenario(
+        name: str,
+        request: Callable[[httpx.AsyncClient, int], "asyncio.Future"],
+        client: httpx.AsyncClient,
+        requests: int,
+        concurrency: int,
+        memory: MemorySampler
+        ) -> dict:
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    received = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal received
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await request(client, i)
+            except httpx.HTTPError as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            received += len(response.content)
+            if response.status_code >= 400:
+                errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+
+    memory.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await memory.stop()
+
+    latencies.sort()
+    result = {
+        "name": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(errors.values()),
+        "error_kinds": errors,
+        "duration_s": round(elapsed, 3),
+        "rps": round(requests / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        "bytes_received": received,
+        "peak_rss_mb": memory.peak_mb,
+    }
+    print(
+        f"{name:<8} {result['rps']:>9.1f} req/s  p50 {result['p50_ms']:>9.3f} ms  "
+        f"p99 {result['p99_ms']:>9.3f} ms  errors {result['errors']:>5}  "
+        f"peak {result['peak_rss_mb'] or '-':>7} MB"
+    )
+    return result
+
+
+def with_database(dsn: str, database: str) -> str:
+    parts = urlsplit(dsn)
+    return urlunsplit(parts._replace(path=f"/{database}"))
+
+
+async def create_database(dsn: str) -> str:
+    name = f"pixeldust_bench_{secrets.token_hex(4)}"
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        await conn.close()
+    conn = await asyncpg.connect(with_database(dsn, name))
+    try:
+        await conn.execute((ROOT / "schema.sql").read_text())
+    finally:
+        await conn.close()
+    return name
+
+
+async def drop_database(dsn: str, name: str):
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    finally:
+        await conn.close()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(dsn: str, port: int, workers: int, storage_root: Path, thumbnails: bool) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "POSTGRES": dsn,
+        "STORAGE_LOCAL_ROOT": str(storage_root),
+        "LOG_ACCESS_SAMPLE_RATE": os.environ.get("LOG_ACCESS_SAMPLE_RATE", "0"),
+        # Variant generation would otherwise keep running behind the upload
+        # scenario and skew whichever scenario comes next.
+        "THUMBNAILS_ENABLED": "true" if thumbnails else "false",
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "utils.launcher", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=ROOT,
+        env=env,
+        start_new_session=True,
+    )
+
+
+async def wait_ready(base_url: str, server: Optional[subprocess.Popen], timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if server is not None and server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become ready in {timeout:.0f}s")
+
+
+async def benchmark(args, base_url: str, pid: Optional[int]) -> List[dict]:
+    rng = random.Random(args.seed)
+    sizes = parse_sizes(args.sizes)
+    payloads = {size: make_png(size) for size, _ in sizes}
+
+    def pick_payload() -> bytes:
+        size = rng.choices([s for s, _ in sizes], weights=[w for _, w in sizes])[0]
+        # Trailing bytes after IEND keep the PNG valid and make every upload unique.
+        return payloads[size] + os.urandom(16)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        email = f"bench-{secrets.token_hex(4)}@example.com"
+        password = secrets.token_urlsafe(12)
+        response = await client.post("/register", json={"name": "bench", "email": email, "password": password})
+        response.raise_for_status()
+        response = await client.post("/login", json={"email": email, "password": password})
+        response.raise_for_status()
+        auth = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        # Files for the serving scenarios, uploaded before anything is timed.
+        filenames = []
+        for _ in range(args.seed_files):
+            response = await client.post(
+                "/upload", headers=auth, files={"file": ("seed.png", pick_payload(), "image/png")}
+            )
+            response.raise_for_status()
+            filenames.append(response.json()["file"]["filename"])
+
+        scenarios = {
+            "login": lambda c, i: c.post("/login", json={"email": email, "password": password}),
+            "upload": lambda c, i: c.post(
+                "/upload", headers=auth, files={"file": (f"bench-{i}.png", pick_payload(), "image/png")}
+            ),
+            "img": lambda c, i: c.get(f"/img/{rng.choice(filenames)}"),
+            "raw": lambda c, i: c.get(f"/raw/{rng.choice(filenames)}"),
+            "files": lambda c, i: c.get("/files", headers=auth),
+            "export": lambda c, i: c.get("/files/export", headers=auth),
+        }
+        counts = {"login": args.login_requests, "export": args.export_requests}
+
+        memory = MemorySampler(pid)
+        results = []
+        for name in args.scenarios:
+            results.append(
+                await run_scenario(
+                    name,
+                    scenarios[name],
+                    client,
+                    counts.get(name) or args.requests,
+                    args.concurrency,
+                    memory,
+                )
+            )
+        return results
+
+
+def compare(results: List[dict], baseline_path: Path, max_regression: float) -> bool:
+    """Print per-scenario changes against a previous run; False if any regressed."""
+    baseline = {s["name"]: s for s in json.loads(baseline_path.read_text())["scenarios"]}
+    ok = True
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        old = baseline.get(result["name"])
+        if old is None or not old["rps"] or not old["p99_ms"]:
+            continue
+        rps = result["rps"] / old["rps"] - 1
+        p99 = result["p99_ms"] / old["p99_ms"] - 1
+        regressed = rps < -max_regression or p99 > max_regression
+        ok = ok and not regressed
+        print(f"{result['name']:<8} req/s {rps:+7.1%}  p99 {p99:+7.1%}{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main_async(args) -> int:
+    database = None
+    server = None
+    storage_root = None
+    base_url = args.url
+    try:
+        if base_url is None:
+            database = await create_database(args.dsn)
+            storage_root = Path(tempfile.mkdtemp(prefix="pixeldust-bench-"))
+            port = free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            server = start_server(with_database(args.dsn, database), port, args.workers, storage_root, args.thumbnails)
+        await wait_ready(base_url, server)
+
+        print(f"Benchmarking {base_url} ({args.concurrency} concurrent, sizes {args.sizes})")
+        results = await benchmark(args, base_url, server.pid if server else args.pid)
+    finally:
+        if server is not None:
+            # uvicorn's supervisor stops its own workers and their pools.
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                os.killpg(server.pid, signal.SIGKILL)
+        if database is not None and not args.keep_database:
+            await drop_database(args.dsn, database)
+        if storage_root is not None:
+            shutil.rmtree(storage_root, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "workers": args.workers if args.url is None else None,
+            "thumbnails": args.thumbnails if args.url is None else None,
+            "concurrency": args.concurrency,
+            "sizes": args.sizes,
+            "seed_files": args.seed_files,
+        },
+        "scenarios": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"\nWrote {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare and not compare(results, Path(args.compare), args.max_regression):
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark PixelDust upload and serving endpoints.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--dsn", help="Postgres server to create a throwaway database on")
+    target.add_argument("--url", help="benchmark an already running server instead (its data is kept)")
+    parser.add_argument("--pid", type=int, help="with --url, server process to sample memory from")
+    parser.add_argument("--workers", type=int, default=1, help="server worker processes (default: 1)")
+    parser.add_argument("--thumbnails", action="store_true", help="generate image variants in the server (off by default)")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight (default: 16)")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario (default: 1000)")
+    parser.add_argument("--login-requests", type=int, default=100, help="requests for login, which hashes a password each time")
+    parser.add_argument("--export-requests", type=int, default=20, help="requests for export, which zips every file each time")
+    parser.add_argument("--sizes", default="16k:0.6,256k:0.3,2m:0.1", help="upload size mix as size:weight,...")
+    parser.add_argument("--seed-files", type=int, default=50, help="files uploaded before the serving scenarios")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=1, help="random seed for file picks and sizes")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request timeout in seconds")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", help="previous JSON results to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="allowed req/s drop or p99 rise (default: 0.10)")
+    parser.add_argument("--keep-database", action="store_true", help="do not drop the benchmark database")
+    sys.exit(asyncio.run(main_async(parser.parse_args(argv))))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,47 @@
 import os
-import random
-import string
+import asyncio
 import uuid
 import hashlib
-import tempfile
-import zipfile
-import threading
-import socketserver
-from http.server import SimpleHTTPRequestHandler
+import secrets
+from collections import namedtuple
 from pathlib import Path
 from datetime import datetime, timedelta, timezone
-from typing import Optional, List
-from utils.logger import log 
-import aiofiles
+from typing import Callable, Optional, List
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+from utils.logger import AccessLogMiddleware, log, stats as logging_stats
+from utils.db import Database
+from utils.views import ViewCounter
+from utils.usage import UsageReconciler
+from utils.expiry import ExpiryScheduler
+from utils.passwords import PasswordHasher
+from utils.cache import LRUCache
+from utils.config import Cache, Embed, Logging, Metrics, Serve, Storage, Thumbnails, Uploads
+from utils.blobstore import store_blob, store_blobs, upload_blob
+from utils.pagination import FILE_SORTS, encode_cursor, decode_cursor
+from utils.zipstream import stream_zip
+from utils.http import OffloadResponse, RangeFileResponse, StorageResponse, make_etag, http_date, is_not_modified, not_modified_response
+from utils.thumbnails import ThumbnailPipeline
+from utils.storage import create_storage
+from utils.invalidation import CacheInvalidationListener
+from utils.cleanup import CleanupWorker, cleanup_progress, delete_file_rows, enqueue_cleanup
+from utils.shortid import ShortIdAllocator
+from utils.metrics import MetricsMiddleware, MetricsRegistry, stats_collector
+from utils import launcher
+from utils.embed import EmbedServer
+from utils.uploads import MULTIPART_OVERHEAD, FileTooLarge, UploadLimitMiddleware, stream_to_temp, discard as discard_upload
 import asyncpg
 from dotenv import load_dotenv
 from fastapi import (
-    FastAPI, HTTPException, Depends, status, Request, UploadFile, File, Header
+    FastAPI, HTTPException, Depends, status, Request, Response, UploadFile, File, Header, Query
 )
 from plyer import notification # You can use it if you want to but i don't really think it would be needed because you would obviously host this in a vps and there's no way you are gonna receive notifcations of this right????
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
+from fastapi.responses import FileResponse, JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from pydantic import BaseModel
-import uvicorn
+from pydantic import BaseModel, Field
 
 
 load_dotenv()
@@ -45,35 +60,21 @@ DATABASE_URL = os.getenv(
 )
 
 
-try:
-    pwd_context = CryptContext(
-        schemes=[
-            "bcrypt", 
-            "sha256_crypt"
-            ], 
-            deprecated="auto"
-            )
-except Exception:
-    pwd_context = CryptContext(
-        schemes=[
-            "sha256_crypt"
-            ], 
-            deprecated="auto"
-            )
+password_hasher = PasswordHasher()
 
-def verify_password(
+async def verify_password(
         plain_password: str, 
         hashed_password: str
         ) -> bool:
-    return pwd_context.verify(
+    return await password_hasher.verify(
         plain_password, 
         hashed_password
         )
 
-def get_password_hash(
+async def get_password_hash(
         password: str
         ) -> str:
-    return pwd_context.hash(
+    return await password_hasher.hash(
         password
         )
 
@@ -91,16 +92,13 @@ def create_access_token(
         algorithm=ALGORITHM
         )
 
-def generate_random_filename(
-        length: int = 8
-        ) -> str:
-    """Generate a random alphanumeric string for filenames."""
-    return ''.join(
-        random.choices(
-            string.ascii_letters + string.digits,
-            k=length
-            ))
-
+def to_naive_utc(
+        value: datetime
+        ) -> datetime:
+    """files.upload_date is a naive TIMESTAMP; normalise aware datetimes to UTC."""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
 
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl="/login"
@@ -139,7 +137,7 @@ class UserSettings(BaseModel):
     email_notifications: bool = True
     public_profile: bool = True
     auto_delete_after_days: int = 0
-    max_file_size_mb: int = 10
+    max_file_size_mb: int = Field(min(10, Uploads.MAX_FILE_SIZE_MB), ge=1, le=Uploads.MAX_FILE_SIZE_MB)
     theme: str = "dark"
     url_length: int = 8
     anonymous_upload: bool = False
@@ -156,6 +154,9 @@ class SessionResponse(BaseModel):
     last_active: datetime
     is_active: bool
 
+class BulkDeleteRequest(BaseModel):
+    file_ids: List[int] = Field(..., min_length=1, max_length=1000)
+
 class ProfileUpdate(BaseModel):
     name: str
     email: str
@@ -165,8 +166,76 @@ class PasswordChange(BaseModel):
     new_password: str
 
 
+metrics = MetricsRegistry()
+database = Database(
+    DATABASE_URL,
+    query_logger=metrics.observe_query if Metrics.ENABLED else None
+    )
+view_counter = ViewCounter(
+    database
+    )
+file_cache = LRUCache(
+    max_size=Cache.FILES_MAX_ENTRIES,
+    ttl=Cache.FILES_TTL
+    )
+user_cache = LRUCache(
+    max_size=Cache.USERS_MAX_ENTRIES,
+    ttl=Cache.USERS_TTL
+    )
+thumbnails = ThumbnailPipeline()
+storage = create_storage()
+short_ids = ShortIdAllocator()
+cleanup_worker = CleanupWorker(
+    database,
+    storage
+    )
+usage_reconciler = UsageReconciler(
+    database
+    )
+cache_listener = CacheInvalidationListener(
+    database,
+    on_invalidate=file_cache.invalidate_many,
+    on_reset=file_cache.clear
+    )
+expiry_scheduler = ExpiryScheduler(
+    database,
+    on_expired=file_cache.invalidate_many,
+    on_cleanup=cleanup_worker.notify
+    )
+
+
+@asynccontextmanager
+async def lifespan(
+        app: FastAPI
+        ):
+    await database.connect()
+    await storage.start()
+    view_counter.start()
+    thumbnails.start()
+    usage_reconciler.start()
+    cleanup_worker.start()
+    expiry_scheduler.start()
+    cache_listener.start()
+    if Metrics.ENABLED:
+        metrics.start()
+    try:
+        yield
+    finally:
+        await metrics.stop()
+        await cache_listener.stop()
+        await expiry_scheduler.stop()
+        await cleanup_worker.stop()
+        await usage_reconciler.stop()
+        await thumbnails.stop()
+        await view_counter.stop()
+        await storage.stop()
+        await database.close()
+        password_hasher.shutdown()
+
+
 app = FastAPI(
-    title="PixelDust Image Hosting"
+    title="PixelDust Image Hosting",
+    lifespan=lifespan
     )
 
 
@@ -184,43 +253,214 @@ app.mount(
         name="static"
         )
 
+# Uploads are staged here before they are handed to the storage backend.
 UPLOAD_DIR = Path(
-    "uploads"
+    Storage.LOCAL_ROOT
     )
 UPLOAD_DIR.mkdir(
     exist_ok=True
     )
 
 
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits={
+        "/upload": Uploads.MAX_FILE_SIZE_MB * 1024 * 1024 + MULTIPART_OVERHEAD,
+        "/upload/batch": Uploads.BATCH_MAX_FILES * (Uploads.MAX_FILE_SIZE_MB * 1024 * 1024 + MULTIPART_OVERHEAD)
+    }
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+if Metrics.ENABLED:
+    app.add_middleware(
+        MetricsMiddleware,
+        registry=metrics
+    )
+    metrics.collectors += [
+        stats_collector("db", database.stats),
+        stats_collector("cache", file_cache.stats, cache="files"),
+        stats_collector("cache", user_cache.stats, cache="users"),
+        stats_collector("views", view_counter.stats),
+        stats_collector("thumbnails", thumbnails.stats),
+        stats_collector("password_hasher", password_hasher.stats),
+        stats_collector("storage", storage.stats),
+        stats_collector("short_ids", short_ids.stats),
+        stats_collector("cleanup", cleanup_worker.stats),
+        stats_collector("expiry", expiry_scheduler.stats),
+        stats_collector("cache_invalidation", cache_listener.stats),
+        stats_collector("usage_reconciler", usage_reconciler.stats),
+        stats_collector("logging", logging_stats),
+    ]
+if Logging.ACCESS_LOG:
+    app.add_middleware(
+        AccessLogMiddleware
+    )
 
 
-async def db_connect():
-    try:
-        return await asyncpg.connect(
-            DATABASE_URL
-            )
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Database connection failed. Check POSTGRES env. Error: {e}"
+async def get_db() -> Database:
+    return database
+
+
+FileMeta = namedtuple(
+    "FileMeta", 
+    ["id", "filename", "file_type", "original_name", "file_path", "size", "mtime", "content_hash"]
+    )
+
+SERVE_HEADERS = {
+    "Cache-Control": "public, max-age=31536000",
+    "X-Content-Type-Options": "nosniff"
+}
+
+async def lookup_file(
+        db: Database,
+        filename: str
+        ) -> Optional[FileMeta]:
+    """Resolve a public short name, going to the database only on a cache miss."""
+    meta = file_cache.get(filename)
+    if meta is not None:
+        return meta
+
+    async with db.acquire() as conn:
+        rec = await conn.fetchrow(
+            "SELECT id, file_type, original_name, file_path, content_hash FROM files WHERE filename = $1",
+            filename
         )
+    if not rec:
+        return None
 
+    st = await storage.stat(
+        rec["file_path"]
+        )
+    meta = FileMeta(
+        rec["id"],
+        filename,
+        rec["file_type"],
+        rec["original_name"],
+        rec["file_path"],
+        st.size if st else None,
+        st.mtime if st else None,
+        rec["content_hash"],
+    )
+    if st:
+        file_cache.set(filename, meta)
+    return meta
+
+
+def local_file_response(
+        path: Path,
+        media_type: str,
+        headers: dict,
+        filename: Optional[str] = None,
+        stat_result: Optional[os.stat_result] = None,
+        on_missing: Optional[Callable[[], None]] = None
+        ) -> Response:
+    """Serve a file under the storage root, or hand it to the front proxy.
+
+    With SERVE_ACCEL set, the proxy sends the file (sendfile, ranges) and
+    this process only writes headers. Otherwise RangeFileResponse streams it,
+    which Starlette already turns into a zero-copy `http.response.pathsend`
+    on ASGI servers that offer that extension.
+
+    Accept-negotiated responses (those with a Vary header) are never
+    offloaded: nginx drops Vary from X-Accel-Redirect responses, and shared
+    caches would then hand AVIF to clients that cannot decode it.
+    """
+    if Serve.ACCEL in ("x-accel-redirect", "x-sendfile") and "Vary" not in headers:
+        resolved = path.resolve()
+        try:
+            relative = resolved.relative_to(UPLOAD_DIR.resolve())
+        except ValueError:
+            relative = None
+        if relative is not None and Serve.ACCEL == "x-accel-redirect":
+            return OffloadResponse(
+                "X-Accel-Redirect",
+                f"{Serve.ACCEL_PREFIX}/{quote(relative.as_posix())}",
+                media_type=media_type,
+                filename=filename,
+                headers=headers
+                )
+        if relative is not None:
+            return OffloadResponse(
+                "X-Sendfile",
+                str(resolved),
+                media_type=media_type,
+                filename=filename,
+                headers=headers
+                )
+    return RangeFileResponse(
+        path,
+        media_type=media_type,
+        filename=filename,
+        stat_result=stat_result,
+        headers=headers,
+        on_missing=on_missing
+        )
 
 
+def stored_response(
+        key: str,
+        size: int,
+        media_type: str,
+        headers: dict,
+        filename: Optional[str] = None,
+        on_missing: Optional[Callable[[], None]] = None
+        ) -> Response:
+    """Serve a stored object, straight from disk when the backend is local.
+
+    Existence comes from the cached lookup, not a per-hit check; if the
+    object has gone since, the response is a 404 and `on_missing` runs.
+    """
+    path = storage.local_path(key)
+    if path is not None:
+        return local_file_response(
+            path,
+            media_type,
+            headers,
+            filename=filename,
+            on_missing=on_missing
+            )
+    return StorageResponse(
+        storage,
+        key,
+        size,
+        media_type=media_type,
+        filename=filename,
+        headers=headers,
+        on_missing=on_missing
+        )
 
 
+async def abandon_objects(
+        db: Database,
+        keys: List[str]
+        ):
+    """Queue objects written for an upload whose transaction did not commit.
+
+    The cleanup worker skips any key a blob row references by the time it
+    runs, so a concurrent upload of the same content keeps its object.
+    """
+    try:
+        async with db.acquire() as conn:
+            async with conn.transaction():
+                await enqueue_cleanup(conn, None, keys)
+    except Exception as e:
+        log.warning(f"Could not queue {len(keys)} abandoned object(s) for cleanup: {e}")
+        return
+    cleanup_worker.notify()
+
 
 async def get_current_user(
         token: str = Depends(
             oauth2_scheme
-            )) -> dict:
+            ),
+        db: Database = Depends(get_db)
+        ) -> dict:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid or missing authentication credentials",
@@ -238,27 +478,45 @@ async def get_current_user(
         email: str = payload.get(
             "sub"
             )
+        user_id: Optional[int] = payload.get(
+            "uid"
+            )
         if not email:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
 
-    conn = await db_connect()
-    try:
-        user = await conn.fetchrow(
-            "SELECT id, name, email, created_at FROM users WHERE email = $1",
-            email
-        )
-    finally:
-        await conn.close()
+    cached = user_cache.get(email)
+    if cached is not None:
+        # The address may now belong to someone else: a token issued before
+        # an email change must not authenticate as the new owner.
+        if user_id is not None and cached["id"] != user_id:
+            raise credentials_exception
+        return dict(cached)
 
-    if not user:
+    async with db.acquire() as conn:
+        if user_id is not None:
+            user = await conn.fetchrow(
+                "SELECT id, name, email, created_at FROM users WHERE id = $1",
+                user_id
+            )
+        else:
+            user = await conn.fetchrow(
+                "SELECT id, name, email, created_at FROM users WHERE email = $1",
+                email
+            )
+
+    # Tokens issued before an email change must stop working, as before.
+    if not user or user["email"] != email:
         raise credentials_exception
+    user = dict(user)
+    user_cache.set(email, user)
     return dict(user)
 
 async def create_session(
         user_id: int, 
-        request: Request
+        request: Request,
+        db: Database
         ) -> str:
     session_token = hashlib.sha256(
         f"{user_id}{datetime.now(timezone.utc)}".encode()
@@ -273,8 +531,7 @@ async def create_session(
     elif hasattr(request, "client") and request.client:
         client_ip = request.client.host
 
-    conn = await db_connect()
-    try:
+    async with db.acquire() as conn:
         await conn.execute(
             """
             INSERT INTO user_sessions (user_id, session_token, device_info, ip_address, user_agent)
@@ -286,8 +543,6 @@ async def create_session(
             client_ip,
             request.headers.get("user-agent", ""),
         )
-    finally:
-        await conn.close()
     return session_token
 
 
@@ -295,6 +550,62 @@ async def create_session(
 async def health():
     return {"status": "ok", "time": datetime.now(timezone.utc).isoformat()}
 
+async def require_metrics_token(
+        authorization: Optional[str] = Header(None)
+        ):
+    """Guard for /stats and /metrics, which expose service internals.
+
+    They answer only to `Authorization: Bearer <METRICS_TOKEN>`, and are
+    hidden entirely while no token is configured.
+    """
+    if not Metrics.TOKEN:
+        raise HTTPException(
+            status_code=404,
+            detail="Not Found"
+            )
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token.encode(), Metrics.TOKEN.encode()):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid or missing metrics token",
+            headers={
+                "WWW-Authenticate": "Bearer"
+                }
+            )
+
+@app.get("/stats", dependencies=[Depends(require_metrics_token)])
+async def service_stats(
+    db: Database = Depends(get_db)
+    ):
+    return {
+        "db": db.stats(),
+        "views": view_counter.stats(),
+        "file_cache": file_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "thumbnails": thumbnails.stats(),
+        "usage_reconciler": usage_reconciler.stats(),
+        "password_hasher": password_hasher.stats(),
+        "storage": storage.stats(),
+        "short_ids": short_ids.stats(),
+        "cleanup": cleanup_worker.stats(),
+        "expiry": expiry_scheduler.stats(),
+        "cache_invalidation": cache_listener.stats(),
+        "logging": logging_stats()
+        }
+
+@app.get("/metrics", dependencies=[Depends(require_metrics_token)])
+async def prometheus_metrics():
+    """Prometheus text exposition of this worker's metrics."""
+    if not Metrics.ENABLED:
+        raise HTTPException(
+            status_code=404,
+            detail="Metrics are disabled"
+            )
+    return Response(
+        metrics.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
 @app.get("/")
 async def serve_index():
     index_path = STATIC_DIR / "index.html"
@@ -328,55 +639,59 @@ async def serve_upload():
 @app.post("/register", response_model=UserResponse)
 async def register(
     user: UserCreate, 
-    request: Request
+    request: Request,
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
+    async with db.acquire() as conn:
         existing_user = await conn.fetchrow("SELECT id FROM users WHERE email = $1", user.email)
-        if existing_user:
+    if existing_user:
+        raise HTTPException(
+            status_code=400, 
+            detail="Email already registered"
+            )
+
+    # Hash without holding a pooled connection, as login does.
+    hashed_password = await get_password_hash(
+        user.password
+        )
+    async with db.acquire() as conn:
+        try:
+            new_user = await conn.fetchrow(
+                """
+                INSERT INTO users (name, email, password)
+                VALUES ($1, $2, $3)
+                RETURNING id, name, email, created_at
+                """,
+                user.name, user.email, hashed_password,
+            )
+        except asyncpg.UniqueViolationError:
             raise HTTPException(
                 status_code=400, 
                 detail="Email already registered"
                 )
 
-        hashed_password = get_password_hash(
-            user.password
-            )
-        new_user = await conn.fetchrow(
-            """
-            INSERT INTO users (name, email, password)
-            VALUES ($1, $2, $3)
-            RETURNING id, name, email, created_at
-            """,
-            user.name, user.email, hashed_password,
-        )
-
         await conn.execute(
             "INSERT INTO user_settings (user_id) VALUES ($1)",
             new_user["id"]
         )
-    finally:
-        await conn.close()
 
     
-    await create_session(new_user["id"], request)
+    await create_session(new_user["id"], request, db)
     return dict(new_user)
 
 @app.post("/login", response_model=Token)
 async def login(
     credentials: UserLogin, 
-    request: Request
+    request: Request,
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
+    async with db.acquire() as conn:
         user = await conn.fetchrow(
             "SELECT id, name, email, password FROM users WHERE email = $1",
             credentials.email
         )
-    finally:
-        await conn.close()
 
-    if not user or not verify_password(
+    if not user or not await verify_password(
         credentials.password, 
         user["password"]
         ):
@@ -390,14 +705,15 @@ async def login(
 
     access_token = create_access_token(
         data={
-            "sub": user["email"]
+            "sub": user["email"],
+            "uid": user["id"]
             },
         expires_delta=timedelta(
             minutes=ACCESS_TOKEN_EXPIRE_MINUTES
             ),
     )
     await create_session(
-        user["id"], request
+        user["id"], request, db
         )
     return {
         "access_token": access_token, 
@@ -405,106 +721,427 @@ async def login(
 
 @app.get("/users/me", response_model=UserResponse)
 async def get_user(
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
     ):
     return current_user
 
 
 @app.get("/files", response_model=List[FileResponseModel])
 async def get_user_files(
-    current_user: dict = Depends(get_current_user)
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    sort: str = Query("newest", pattern="^(" + "|".join(FILE_SORTS) + ")$"),
+    file_type: Optional[List[str]] = Query(None),
+    uploaded_after: Optional[datetime] = None,
+    uploaded_before: Optional[datetime] = None,
+    q: Optional[str] = None,
+    filename: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
+    """List the caller's files one page at a time.
+
+    Pages are keyset-paginated on (sort column, id); when more rows are
+    available the cursor for the next page is returned in X-Next-Cursor.
+    """
+    column, direction, _ = FILE_SORTS[sort]
+    conditions = ["user_id = $1"]
+    args = [current_user["id"]]
+
+    def param(value) -> str:
+        args.append(value)
+        return f"${len(args)}"
+
+    if file_type:
+        conditions.append(f"file_type = ANY({param(file_type)}::text[])")
+    if uploaded_after:
+        conditions.append(f"upload_date >= {param(to_naive_utc(uploaded_after))}")
+    if uploaded_before:
+        conditions.append(f"upload_date < {param(to_naive_utc(uploaded_before))}")
+    if q:
+        pattern = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append(f"original_name ILIKE {param(f'%{pattern}%')}")
+    if filename:
+        conditions.append(f"filename = {param(filename)}")
+    if cursor:
+        try:
+            key, last_id = decode_cursor(cursor, sort)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=400, 
+                detail=str(e)
+                )
+        if isinstance(key, datetime):
+            key = to_naive_utc(key)
+        op = "<" if direction == "DESC" else ">"
+        conditions.append(f"({column}, id) {op} ({param(key)}, {param(last_id)})")
+
+    async with db.acquire() as conn:
         rows = await conn.fetch(
-            """
+            f"""
             SELECT id, filename, original_name, file_type, file_size, upload_date, views
             FROM files
-            WHERE user_id = $1
-            ORDER BY upload_date DESC
+            WHERE {" AND ".join(conditions)}
+            ORDER BY {column} {direction}, id {direction}
+            LIMIT {param(limit + 1)}
             """,
-            current_user["id"],
+            *args,
         )
-    finally:
-        await conn.close()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            sort, 
+            last[column], 
+            last["id"]
+            )
     return [dict(r) for r in rows]
 
+ALLOWED_UPLOAD_TYPES = {
+    "image/png",
+    "image/jpeg",
+    "image/jpg",
+    "image/gif",
+    "image/svg+xml"
+    }
+
 @app.post("/upload")
 async def upload_file(
     file: UploadFile = File(...), 
     current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db),
     url_length: Optional[int] = Header(8, alias="X-URL-Length")
 ):
-    allowed_types = {
-        "image/png", 
-        "image/jpeg", 
-        "image/jpg", 
-        "image/gif", 
-        "image/svg+xml"
-        }
-    if file.content_type not in allowed_types:
+    if file.content_type not in ALLOWED_UPLOAD_TYPES:
         raise HTTPException(
             status_code=400, 
             detail="Unsupported file type"
             )
 
-    content = await file.read()
-    if len(content) > 10 * 1024 * 1024:
-        raise HTTPException(
-            status_code=400, 
-            detail="File too large. Maximum size is 10MB"
-            )
-    
-    conn = await db_connect()
-    try:
-        current_usage = await conn.fetchval(
-            "SELECT COALESCE(SUM(file_size), 0) FROM files WHERE user_id = $1",
+    async with db.acquire() as conn:
+        limits = await conn.fetchrow(
+            """
+            SELECT u.storage_used_bytes, s.max_file_size_mb
+            FROM users u
+            LEFT JOIN user_settings s ON s.user_id = u.id
+            WHERE u.id = $1
+            """,
             current_user["id"]
         )
-        if (current_usage or 0) + len(content) > MAX_STORAGE_BYTES:
+
+    max_file_size_mb = min(
+        limits["max_file_size_mb"] or 10,
+        Uploads.MAX_FILE_SIZE_MB
+        )
+    file_limit = max_file_size_mb * 1024 * 1024
+    # Early bound only; the quota is enforced atomically when the row is inserted.
+    remaining = MAX_STORAGE_BYTES - limits["storage_used_bytes"]
+
+    try:
+        staged = await stream_to_temp(
+            file,
+            UPLOAD_DIR,
+            max_bytes=min(file_limit, remaining)
+            )
+    except FileTooLarge:
+        if remaining < file_limit:
             raise HTTPException(
                 status_code=400, 
                 detail="Storage limit exceeded. Maximum 1000MB allowed"
                 )
-    finally:
-        await conn.close()
+        raise HTTPException(
+            status_code=400, 
+            detail=f"File too large. Maximum size is {max_file_size_mb}MB"
+            )
 
     file_extension = Path(file.filename).suffix
-    random_name = generate_random_filename(url_length)  
-    unique_filename = f"{random_name}{file_extension}"
-    file_path = UPLOAD_DIR / unique_filename
 
-    async with aiofiles.open(file_path, "wb") as f:
-        await f.write(content)
-
-    conn = await db_connect()
+    # Write the object before taking the user's row lock; the transaction
+    # below only references it.
+    written = []
     try:
-        rec = await conn.fetchrow(
+        file_path, created = await upload_blob(
+            storage,
+            staged
+            )
+        if created:
+            written.append(file_path)
+        async with db.acquire() as conn:
+            async with conn.transaction():
+                reserved = await conn.fetchval(
+                    """
+                    UPDATE users
+                       SET storage_used_bytes = storage_used_bytes + $2
+                     WHERE id = $1 AND storage_used_bytes + $2 <= $3
+                    RETURNING storage_used_bytes
+                    """,
+                    current_user["id"],
+                    staged.size,
+                    MAX_STORAGE_BYTES,
+                )
+                if reserved is None:
+                    raise HTTPException(
+                        status_code=400, 
+                        detail="Storage limit exceeded. Maximum 1000MB allowed"
+                        )
+                file_path, rewritten = await store_blob(
+                    conn,
+                    storage,
+                    staged
+                    )
+                if rewritten and file_path not in written:
+                    written.append(file_path)
+                rec = await short_ids.insert(
+                    conn,
+                    lambda unique_filename: conn.fetchrow(
+                        """
+                        INSERT INTO files (user_id, filename, original_name, file_path, file_type, file_size, content_hash)
+                        VALUES ($1, $2, $3, $4, $5, $6, $7)
+                        RETURNING id, filename, original_name, file_type, file_size, upload_date, views
+                        """,
+                        current_user["id"],
+                        unique_filename,
+                        file.filename,
+                        file_path,
+                        file.content_type,
+                        staged.size,
+                        staged.sha256,
+                    ),
+                    length=url_length,
+                    suffix=file_extension
+                )
+    except BaseException:
+        if written:
+            await abandon_objects(
+                db,
+                written
+                )
+        raise
+    finally:
+        discard_upload(staged.path)
+
+    local_path = storage.local_path(file_path)
+    if written and local_path is not None:
+        thumbnails.submit(
+            local_path,
+            file.content_type
+            )
+    return {"message": "File uploaded successfully", "file": dict(rec)}
+
+@app.post("/upload/batch")
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db),
+    url_length: Optional[int] = Header(8, alias="X-URL-Length")
+):
+    """Upload several files in one request.
+
+    Files are staged concurrently, then the quota is checked once and every
+    accepted file is recorded with a single INSERT. The response lists one
+    result per file, in request order, with either `file` or `error`.
+    """
+    if len(files) > Uploads.BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files. Maximum is {Uploads.BATCH_MAX_FILES} per batch"
+            )
+
+    async with db.acquire() as conn:
+        limits = await conn.fetchrow(
             """
-            INSERT INTO files (user_id, filename, original_name, file_path, file_type, file_size)
-            VALUES ($1, $2, $3, $4, $5, $6)
-            RETURNING id, filename, original_name, file_type, file_size, upload_date, views
+            SELECT u.storage_used_bytes, s.max_file_size_mb
+            FROM users u
+            LEFT JOIN user_settings s ON s.user_id = u.id
+            WHERE u.id = $1
             """,
-            current_user["id"],
-            unique_filename,
-            file.filename,
-            str(file_path),
-            file.content_type,
-            len(content),
+            current_user["id"]
+        )
+
+    max_file_size_mb = min(
+        limits["max_file_size_mb"] or 10,
+        Uploads.MAX_FILE_SIZE_MB
+        )
+    file_limit = max_file_size_mb * 1024 * 1024
+    remaining = MAX_STORAGE_BYTES - limits["storage_used_bytes"]
+    results = [
+        {"original_name": f.filename} for f in files
+        ]
+    semaphore = asyncio.Semaphore(
+        Uploads.BATCH_CONCURRENCY
+        )
+
+    async def stage(i: int, file: UploadFile):
+        if file.content_type not in ALLOWED_UPLOAD_TYPES:
+            results[i]["error"] = "Unsupported file type"
+            return None
+        async with semaphore:
+            try:
+                return await stream_to_temp(
+                    file,
+                    UPLOAD_DIR,
+                    max_bytes=min(file_limit, remaining)
+                    )
+            except FileTooLarge:
+                results[i]["error"] = (
+                    "Storage limit exceeded. Maximum 1000MB allowed" if remaining < file_limit
+                    else f"File too large. Maximum size is {max_file_size_mb}MB"
+                    )
+                return None
+
+    staged = await asyncio.gather(
+        *(stage(i, f) for i, f in enumerate(files)),
+        return_exceptions=True
+        )
+    failed = next((s for s in staged if isinstance(s, BaseException)), None)
+    staged = [None if isinstance(s, BaseException) else s for s in staged]
+    if failed is not None:
+        for upload in staged:
+            if upload is not None:
+                discard_upload(upload.path)
+        raise failed
+
+    # Write new objects before taking the user's row lock, for the files the
+    # usage read above leaves room for; the transaction re-checks the quota
+    # and only takes the references.
+    expected = limits["storage_used_bytes"]
+    unique = {}
+    for upload in staged:
+        if upload is not None and expected + upload.size <= MAX_STORAGE_BYTES:
+            expected += upload.size
+            unique.setdefault(upload.sha256, upload)
+
+    async def place(upload):
+        async with semaphore:
+            return await upload_blob(
+                storage,
+                upload
+                )
+
+    placed = await asyncio.gather(
+        *(place(u) for u in unique.values()),
+        return_exceptions=True
         )
+    written = [p[0] for p in placed if not isinstance(p, BaseException) and p[1]]
+    failed = next((p for p in placed if isinstance(p, BaseException)), None)
+    if failed is not None:
+        for upload in staged:
+            if upload is not None:
+                discard_upload(upload.path)
+        if written:
+            await abandon_objects(
+                db,
+                written
+                )
+        raise failed
+
+    stored = []
+    try:
+        async with db.acquire() as conn:
+            async with conn.transaction():
+                used = await conn.fetchval(
+                    "SELECT storage_used_bytes FROM users WHERE id = $1 FOR UPDATE",
+                    current_user["id"]
+                )
+                accepted = []
+                for i, upload in enumerate(staged):
+                    if upload is None:
+                        continue
+                    if used + upload.size > MAX_STORAGE_BYTES:
+                        results[i]["error"] = "Storage limit exceeded. Maximum 1000MB allowed"
+                        continue
+                    used += upload.size
+                    accepted.append(i)
+
+                if accepted:
+                    await conn.execute(
+                        "UPDATE users SET storage_used_bytes = $2 WHERE id = $1",
+                        current_user["id"],
+                        used
+                    )
+                    stored = await store_blobs(
+                        conn,
+                        storage,
+                        [staged[i] for i in accepted],
+                        Uploads.BATCH_CONCURRENCY
+                        )
+                    written += [
+                        key for key, rewritten in stored if rewritten and key not in written
+                        ]
+                    inserted = {}
+
+                    async def insert_rows(names):
+                        rows = await conn.fetch(
+                            """
+                            INSERT INTO files (user_id, filename, original_name, file_path, file_type, file_size, content_hash)
+                            SELECT $1, * FROM unnest($2::text[], $3::text[], $4::text[], $5::text[], $6::int[], $7::text[])
+                            RETURNING id, filename, original_name, file_type, file_size, upload_date, views
+                            """,
+                            current_user["id"],
+                            names,
+                            [files[i].filename for i in accepted],
+                            [key for key, _ in stored],
+                            [files[i].content_type for i in accepted],
+                            [staged[i].size for i in accepted],
+                            [staged[i].sha256 for i in accepted]
+                        )
+                        inserted.update(zip(accepted, names))
+                        return {r["filename"]: dict(r) for r in rows}
+
+                    rows = await short_ids.insert_many(
+                        conn,
+                        insert_rows,
+                        [Path(files[i].filename).suffix for i in accepted],
+                        length=url_length
+                    )
+                    for i, name in inserted.items():
+                        results[i]["file"] = rows[name]
+    except BaseException:
+        if written:
+            await abandon_objects(
+                db,
+                written
+                )
+        raise
     finally:
-        await conn.close()
+        for upload in staged:
+            if upload is not None:
+                discard_upload(upload.path)
 
-    return {"message": "File uploaded successfully", "file": dict(rec)}
+    # Objects written for files the quota re-check turned away.
+    referenced = {
+        key: files[i].content_type for i, (key, _) in zip(accepted, stored)
+        }
+    unused = [key for key in written if key not in referenced]
+    if unused:
+        await abandon_objects(
+            db,
+            unused
+            )
+    for key in written:
+        local_path = storage.local_path(key)
+        if key in referenced and local_path is not None:
+            thumbnails.submit(
+                local_path,
+                referenced[key]
+                )
+    return {
+        "uploaded": sum(1 for r in results if "file" in r),
+        "files": results
+        }
 
 @app.get("/files/{file_id}/view")
 async def view_file(
-    file_id: int
+    file_id: int,
+    request: Request,
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
+    async with db.acquire() as conn:
         rec = await conn.fetchrow(
-            "SELECT file_path, original_name, file_type FROM files WHERE id = $1",
+            "SELECT file_path, original_name, file_type, content_hash FROM files WHERE id = $1",
             file_id
         )
         if not rec:
@@ -512,29 +1149,45 @@ async def view_file(
                 status_code=404, 
                 detail="File not found"
                 )
-        await conn.execute("UPDATE files SET views = views + 1 WHERE id = $1", file_id)
-    finally:
-        await conn.close()
 
-    file_path = Path(rec["file_path"])
-    if not file_path.exists():
+    st = await storage.stat(
+        rec["file_path"]
+        )
+    if st is None:
         raise HTTPException(
-            status_code=404, 
+            status_code=404,
             detail="File not found on disk"
             )
 
-    return FileResponse(
-        file_path,
-        media_type=rec["file_type"],
-        filename=rec["original_name"],
+    etag = make_etag(rec["content_hash"], st.size, st.mtime)
+    if is_not_modified(request.headers, etag, st.mtime):
+        return not_modified_response(
+            etag,
+            st.mtime,
+            SERVE_HEADERS
+            )
+    view_counter.hit(
+        file_id
+        )
+
+    return stored_response(
+        rec["file_path"],
+        st.size,
+        rec["file_type"],
+        {
+            **SERVE_HEADERS,
+            "ETag": etag,
+            "Last-Modified": http_date(st.mtime)
+        },
+        filename=rec["original_name"]
     )
 
 @app.get("/files/{file_id}/info")
 async def get_file_info(
-    file_id: int
+    file_id: int,
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
+    async with db.acquire() as conn:
         rec = await conn.fetchrow(
             "SELECT id, filename, original_name, file_type, file_size, upload_date, views FROM files WHERE id = $1",
             file_id
@@ -544,39 +1197,44 @@ async def get_file_info(
                 status_code=404, 
                 detail="File not found"
                 )
-    finally:
-        await conn.close()
     return dict(rec)
 
 @app.get("/img/{filename}")
 async def discord_embed_view(
     filename: str, 
-    request: Request
+    request: Request,
+    db: Database = Depends(get_db)
     ):
     # user_agent = request.headers.get("user-agent", "").lower()
     # is_discord = "discordbot" in user_agent
 
-    conn = await db_connect()
-    try:
-        rec = await conn.fetchrow(
-            "SELECT id, original_name, file_type FROM files WHERE filename = $1",
-            filename
+    rec = await lookup_file(
+        db, 
+        filename
         )
-        if not rec:
-            return FileResponse(
-                str(STATIC_DIR / "404.html"), 
-                status_code=404) if (STATIC_DIR / "404.html").exists() else JSONResponse(
-                    {
-                        "detail": "Not found"
-                        }, 
-                        404
-                        )
-        await conn.execute("UPDATE files SET views = views + 1 WHERE filename = $1", filename)
-    finally:
-        await conn.close()
+    if not rec:
+        return FileResponse(
+            str(STATIC_DIR / "404.html"), 
+            status_code=404) if (STATIC_DIR / "404.html").exists() else JSONResponse(
+                {
+                    "detail": "Not found"
+                    }, 
+                    404
+                    )
 
-    file_path = UPLOAD_DIR / filename
-    if not file_path.exists():
+    if rec.mtime is not None:
+        etag = make_etag(rec.content_hash, rec.size, rec.mtime)
+        if is_not_modified(request.headers, etag, rec.mtime):
+            return not_modified_response(
+                etag, 
+                rec.mtime, 
+                SERVE_HEADERS
+                )
+    view_counter.hit(
+        rec.id
+        )
+
+    if rec.mtime is None:
         return FileResponse(
             str(STATIC_DIR / "404.html"), 
             status_code=404) if (STATIC_DIR / "404.html").exists() else JSONResponse(
@@ -586,69 +1244,194 @@ async def discord_embed_view(
                     404
                     )
 
+    return stored_response(
+        rec.file_path,
+        rec.size,
+        rec.file_type,
+        validator_headers(rec),
+        filename=rec.original_name,
+        on_missing=lambda: file_cache.invalidate(rec.filename)
+        )
+
+def validator_headers(
+        rec: FileMeta
+        ) -> dict:
+    headers = dict(SERVE_HEADERS)
+    if rec.mtime is not None:
+        headers["ETag"] = make_etag(rec.content_hash, rec.size, rec.mtime)
+        headers["Last-Modified"] = http_date(rec.mtime)
+    return headers
+
+async def variant_response(
+        rec: FileMeta,
+        width: int,
+        request: Request
+        ) -> Response:
+    """Serve the closest resized variant, or the original while none exists.
+
+    Variants are generated next to local files only; with a remote storage
+    backend the original is always served.
+    """
+    source = storage.local_path(rec.file_path)
+    variant = thumbnails.pick_variant(
+        source,
+        rec.file_type,
+        width,
+        request.headers.get("accept", "")
+        ) if source is not None else None
     headers = {
-        "Cache-Control": "public, max-age=31536000",
-        "X-Content-Type-Options": "nosniff"
+        **SERVE_HEADERS,
+        "Vary": "Accept"
     }
-    return FileResponse(
-        file_path, 
-        media_type=rec["file_type"], 
-        filename=rec["original_name"], 
-        headers=headers
+
+    if variant is not None:
+        path, media_type = variant
+        try:
+            st = path.stat()
+        except OSError:
+            variant = None
+    if variant is not None:
+        # Variants share the original's hash, so tell them apart by suffix.
+        suffix = path.name[len(source.name):]
+        etag = make_etag(rec.content_hash, st.st_size, st.st_mtime, suffix)
+        if is_not_modified(request.headers, etag, st.st_mtime):
+            return not_modified_response(
+                etag, 
+                st.st_mtime, 
+                headers
+                )
+        return local_file_response(
+            path,
+            media_type,
+            {
+                **headers,
+                "ETag": etag,
+                "Last-Modified": http_date(st.st_mtime)
+            },
+            stat_result=st
+            )
+
+    if rec.mtime is None:
+        raise HTTPException(
+            status_code=404, 
+            detail="File not found on disk"
+            )
+
+    headers = {
+        **validator_headers(rec),
+        "Vary": "Accept"
+    }
+    # Variants still being generated: don't let caches pin the full-size file.
+    if source is not None and thumbnails.submit(source, rec.file_type):
+        headers["Cache-Control"] = "public, max-age=60"
+    etag = headers["ETag"]
+    if is_not_modified(request.headers, etag, rec.mtime):
+        return not_modified_response(
+            etag, 
+            rec.mtime, 
+            headers
+            )
+    return stored_response(
+        rec.file_path,
+        rec.size,
+        rec.file_type,
+        headers,
+        on_missing=lambda: file_cache.invalidate(rec.filename)
         )
 
 @app.get("/raw/{filename}")
 async def raw_image_view(
-    filename: str
+    filename: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=10000),
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
-        rec = await conn.fetchrow(
-            "SELECT id, original_name, file_type FROM files WHERE filename = $1",
-            filename
+    rec = await lookup_file(
+        db, 
+        filename
         )
-        if not rec:
-            raise HTTPException(
-                status_code=404, 
-                detail="File not found"
+    if not rec:
+        raise HTTPException(
+            status_code=404, 
+            detail="File not found"
+            )
+
+    if w is not None:
+        response = await variant_response(
+            rec, 
+            w, 
+            request
+            )
+        if response.status_code != 304:
+            view_counter.hit(
+                rec.id
                 )
-        await conn.execute("UPDATE files SET views = views + 1 WHERE filename = $1", filename)
-    finally:
-        await conn.close()
+        return response
+
+    if rec.mtime is not None:
+        etag = make_etag(rec.content_hash, rec.size, rec.mtime)
+        if is_not_modified(request.headers, etag, rec.mtime):
+            return not_modified_response(
+                etag, 
+                rec.mtime, 
+                SERVE_HEADERS
+                )
+    view_counter.hit(
+        rec.id
+        )
 
-    file_path = UPLOAD_DIR / filename
-    if not file_path.exists():
+    if rec.mtime is None:
         raise HTTPException(
-            status_code=404, 
+            status_code=404,
             detail="File not found on disk"
             )
 
-    return FileResponse(
-        file_path,
-        media_type=rec["file_type"],
-        filename=rec["original_name"],
-        headers={
-            "Cache-Control": "public, max-age=31536000",
-            "X-Content-Type-Options": "nosniff"
-        }
+    return stored_response(
+        rec.file_path,
+        rec.size,
+        rec.file_type,
+        validator_headers(rec),
+        filename=rec.original_name,
+        on_missing=lambda: file_cache.invalidate(rec.filename)
     )
 
+@app.get("/thumb/{filename}")
+async def thumbnail_view(
+    filename: str,
+    request: Request,
+    db: Database = Depends(get_db)
+    ):
+    rec = await lookup_file(
+        db, 
+        filename
+        )
+    if not rec:
+        raise HTTPException(
+            status_code=404, 
+            detail="File not found"
+            )
+    return await variant_response(
+        rec, 
+        Thumbnails.THUMB_WIDTH, 
+        request
+        )
+
 @app.get("/view/{filename}")
 async def view_page_redirect(
-    filename: str
+    filename: str,
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
-        rec = await conn.fetchrow("SELECT id FROM files WHERE filename = $1", filename)
-        if not rec:
-            return FileResponse(
-                str(STATIC_DIR / "404.html"), 
-                status_code=404) if (STATIC_DIR / "404.html").exists() else HTMLResponse(
-                    "<h1>Not found</h1>", 
-                    status_code=404
-                    )
-    finally:
-        await conn.close()
+    rec = await lookup_file(
+        db, 
+        filename
+        )
+    if not rec:
+        return FileResponse(
+            str(STATIC_DIR / "404.html"), 
+            status_code=404) if (STATIC_DIR / "404.html").exists() else HTMLResponse(
+                "<h1>Not found</h1>", 
+                status_code=404
+                )
     path = STATIC_DIR / "view.html"
     return FileResponse(
         str(path)) if path.exists() else HTMLResponse(
@@ -659,10 +1442,10 @@ async def view_page_redirect(
 
 @app.get("/settings", response_model=UserSettings)
 async def get_settings(
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
+    async with db.acquire() as conn:
         settings = await conn.fetchrow(
             "SELECT * FROM user_settings WHERE user_id = $1",
             current_user["id"]
@@ -673,17 +1456,21 @@ async def get_settings(
                 current_user["id"]
             )
             return UserSettings()
-    finally:
-        await conn.close()
-    return UserSettings(**dict(settings))
+    settings = dict(settings)
+    # Rows saved under a higher UPLOAD_MAX_FILE_SIZE_MB report the cap in force.
+    settings["max_file_size_mb"] = min(
+        settings["max_file_size_mb"],
+        Uploads.MAX_FILE_SIZE_MB
+        )
+    return UserSettings(**settings)
 
 @app.put("/settings")
 async def update_settings(
     settings: UserSettings, 
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
+    async with db.acquire() as conn:
         await conn.execute(
             """
             UPDATE user_settings
@@ -705,8 +1492,6 @@ async def update_settings(
             settings.anonymous_upload,
             current_user["id"],
         )
-    finally:
-        await conn.close()
     return {"message": "Settings updated successfully"}
 
 
@@ -714,10 +1499,10 @@ async def update_settings(
 @app.put("/profile")
 async def update_profile(
     profile: ProfileUpdate, 
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
+    async with db.acquire() as conn:
         existing = await conn.fetchrow(
             "SELECT id FROM users WHERE email = $1 AND id != $2",
             profile.email, current_user["id"]
@@ -729,48 +1514,60 @@ async def update_profile(
             "UPDATE users SET name = $1, email = $2 WHERE id = $3",
             profile.name, profile.email, current_user["id"]
         )
-    finally:
-        await conn.close()
+
+    user_cache.invalidate_many(
+        [current_user["email"], profile.email]
+        )
     return {"message": "Profile updated successfully"}
 
 @app.post("/change-password")
 async def change_password(
     password_data: PasswordChange, 
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
+    async with db.acquire() as conn:
         row = await conn.fetchrow("SELECT password FROM users WHERE id = $1", current_user["id"])
-        if not row or not verify_password(
-            password_data.current_password, 
-            row["password"]
-            ):
-            raise HTTPException(
-                status_code=400, 
-                detail="Current password is incorrect"
-                )
+    if not row or not await verify_password(
+        password_data.current_password, 
+        row["password"]
+        ):
+        raise HTTPException(
+            status_code=400, 
+            detail="Current password is incorrect"
+            )
 
-        new_hashed = get_password_hash(
-            password_data.new_password
+    new_hashed = await get_password_hash(
+        password_data.new_password
+        )
+    async with db.acquire() as conn:
+        # Only replace the hash that was verified, in case it changed meanwhile.
+        result = await conn.execute(
+            "UPDATE users SET password = $1 WHERE id = $2 AND password = $3",
+            new_hashed, current_user["id"], row["password"]
+        )
+    if result == "UPDATE 0":
+        raise HTTPException(
+            status_code=400, 
+            detail="Current password is incorrect"
             )
-        await conn.execute("UPDATE users SET password = $1 WHERE id = $2", new_hashed, current_user["id"])
-    finally:
-        await conn.close()
+
+    user_cache.invalidate(
+        current_user["email"]
+        )
     return {"message": "Password changed successfully"}
 
 
 @app.get("/sessions", response_model=List[SessionResponse])
 async def get_sessions(
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
+    async with db.acquire() as conn:
         rows = await conn.fetch(
             "SELECT * FROM user_sessions WHERE user_id = $1 ORDER BY last_active DESC",
             current_user["id"]
         )
-    finally:
-        await conn.close()
     out = []
     for r in rows:
         out.append({
@@ -789,10 +1586,10 @@ async def get_sessions(
 @app.delete("/sessions/{session_token}")
 async def terminate_session(
     session_token: str, 
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
+    async with db.acquire() as conn:
         session = await conn.fetchrow(
             "SELECT user_id FROM user_sessions WHERE session_token = $1",
             session_token
@@ -806,8 +1603,6 @@ async def terminate_session(
             "DELETE FROM user_sessions WHERE session_token = $1",
             session_token
         )
-    finally:
-        await conn.close()
     if result == "DELETE 0":
         raise HTTPException(
             status_code=404, 
@@ -819,71 +1614,129 @@ async def terminate_session(
 
 @app.delete("/files/wipe")
 async def wipe_user_files(
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
-        files = await conn.fetch(
-            "SELECT id, filename, file_path FROM files WHERE user_id = $1",
-            current_user["id"]
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            files = await conn.fetch(
+                "DELETE FROM files WHERE user_id = $1 RETURNING filename, file_path, content_hash, file_size",
+                current_user["id"]
+            )
+            job_id = await delete_file_rows(
+                conn,
+                current_user["id"],
+                files
+                )
+
+    file_cache.invalidate_many(
+        f["filename"] for f in files
         )
-        deleted_count = 0
-        for f in files:
-            fp = Path(f["file_path"]) if f["file_path"] else (UPLOAD_DIR / f["filename"])
-            if fp.exists():
-                try:
-                    fp.unlink()
-                    deleted_count += 1
-                except Exception as e:
-                    log.error(f"Failed to delete {fp}: {e}")
-
-        await conn.execute("DELETE FROM files WHERE user_id = $1", current_user["id"])
-    finally:
-        await conn.close()
+    cleanup_worker.notify()
+    return {
+        "message": f"Removed {len(files)} files and cleared file records.",
+        "job_id": job_id
+        }
+
+
+@app.post("/files/delete")
+async def bulk_delete_files(
+    request: BulkDeleteRequest,
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
+    ):
+    file_ids = list(set(request.file_ids))
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            files = await conn.fetch(
+                """
+                DELETE FROM files
+                 WHERE user_id = $1 AND id = ANY($2::int[])
+                RETURNING id, filename, file_path, content_hash, file_size
+                """,
+                current_user["id"],
+                file_ids
+            )
+            job_id = await delete_file_rows(
+                conn,
+                current_user["id"],
+                files
+                )
+
+    file_cache.invalidate_many(
+        f["filename"] for f in files
+        )
+    cleanup_worker.notify()
+    deleted = {f["id"] for f in files}
+    return {
+        "deleted": len(deleted),
+        "not_found": [i for i in file_ids if i not in deleted],
+        "job_id": job_id
+        }
 
-    return {"message": f"Removed {deleted_count} files and cleared file records."}
+
+@app.get("/files/cleanup/{job_id}")
+async def get_cleanup_progress(
+    job_id: str,
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
+    ):
+    async with db.acquire() as conn:
+        progress = await cleanup_progress(
+            conn,
+            job_id,
+            current_user["id"]
+            )
+    if progress is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Cleanup job not found"
+            )
+    return progress
 
 
 @app.delete("/files/{file_id}")
 async def delete_file(
-    file_id: int, 
-    current_user: dict = Depends(get_current_user)
+    file_id: int,
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
-        rec = await conn.fetchrow(
-            "SELECT file_path FROM files WHERE id = $1 AND user_id = $2",
-            file_id, current_user["id"]
-        )
-        if not rec:
-            raise HTTPException(
-                status_code=404, 
-                detail="File not found"
+    async with db.acquire() as conn:
+        async with conn.transaction():
+            rec = await conn.fetchrow(
+                "DELETE FROM files WHERE id = $1 AND user_id = $2 RETURNING filename, file_path, content_hash, file_size",
+                file_id, current_user["id"]
+            )
+            if not rec:
+                raise HTTPException(
+                    status_code=404,
+                    detail="File not found"
+                    )
+            job_id = await delete_file_rows(
+                conn,
+                current_user["id"],
+                [rec]
                 )
-        await conn.execute("DELETE FROM files WHERE id = $1", file_id)
-    finally:
-        await conn.close()
 
-    fp = Path(rec["file_path"])
-    if fp.exists():
-        try:
-            fp.unlink()
-        except Exception:
-            pass
-    return {"message": "File deleted successfully"}
+    file_cache.invalidate(
+        rec["filename"]
+        )
+    cleanup_worker.notify()
+    return {
+        "message": "File deleted successfully",
+        "job_id": job_id
+        }
 
 @app.get("/storage/usage")
 async def get_storage_usage(
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
+    async with db.acquire() as conn:
         usage = await conn.fetchval(
-            "SELECT COALESCE(SUM(file_size), 0) FROM files WHERE user_id = $1",
+            "SELECT storage_used_bytes FROM users WHERE id = $1",
             current_user["id"]
         )
-    finally:
-        await conn.close()
 
     usage = usage or 0
     return {
@@ -895,12 +1748,12 @@ async def get_storage_usage(
 
 @app.get("/files/export")
 async def export_user_files(
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db: Database = Depends(get_db)
     ):
-    conn = await db_connect()
-    try:
+    async with db.acquire() as conn:
         rows = await conn.fetch(
-            "SELECT filename, original_name FROM files WHERE user_id = $1",
+            "SELECT file_path, original_name, file_type FROM files WHERE user_id = $1 ORDER BY upload_date, id",
             current_user["id"],
         )
         if not rows:
@@ -909,54 +1762,28 @@ async def export_user_files(
                 detail="No files to export"
                 )
 
-        tmpdir = tempfile.mkdtemp()
-        zip_path = os.path.join(tmpdir, f"user_{current_user['id']}_files.zip")
-
-        with zipfile.ZipFile(zip_path, "w") as zipf:
-            for r in rows:
-                file_path = os.path.join(str(UPLOAD_DIR), r["filename"])
-                if os.path.exists(file_path):
-                    zipf.write(file_path, arcname=r["original_name"])
-    finally:
-        await conn.close()
-
-    return FileResponse(
-        zip_path,
-        filename=f"user_{current_user['id']}_files.zip",
+    # Raster formats are already compressed; only deflate text-based SVGs.
+    entries = [
+        (r["file_path"], r["original_name"], r["file_type"] == "image/svg+xml")
+        for r in rows
+        ]
+    return StreamingResponse(
+        stream_zip(
+            entries,
+            storage,
+            chunk_size=Uploads.CHUNK_SIZE
+            ),
         media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="user_{current_user["id"]}_files.zip"'
+        }
     )
 
 
-class EmbedHandler(SimpleHTTPRequestHandler):
-    def do_GET(self):
-        if self.path.startswith("/img/"):
-            filename = self.path[5:]  
-            self.send_response(302)
-            self.send_header("Location", f"http://localhost:8000/img/{filename}")
-            self.end_headers()
-        else:
-            super().do_GET()
-
-def run_embed_server():
-    with socketserver.TCPServer(("", 8080), EmbedHandler) as httpd:
-        log.info(
-            "Embed server running on port 8080"
-            )
-        httpd.serve_forever()
-
-
 if __name__ == "__main__":
     
-    t = threading.Thread(
-        target=run_embed_server, 
-        daemon=True
-        )
-    t.start()
-    log.info(
-        "Starting PixelDust on http://localhost:8000"
-        )
-    uvicorn.run(
-        app, 
-        host="localhost", 
-        port=8000
-        )
+    if Embed.ENABLED:
+        EmbedServer(
+            DATABASE_URL
+            ).start()
+    launcher.main()
@@ -5,10 +5,21 @@ CREATE TABLE IF NOT EXISTS users (
     email VARCHAR(255) UNIQUE NOT NULL,
     password VARCHAR(255) NOT NULL,
     avatar_url VARCHAR(500),
+    storage_used_bytes BIGINT NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+ALTER TABLE users ADD COLUMN IF NOT EXISTS storage_used_bytes BIGINT NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 VARCHAR(64) PRIMARY KEY,
+    file_path VARCHAR(500) NOT NULL,
+    file_size BIGINT NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 CREATE TABLE IF NOT EXISTS files (
     id SERIAL PRIMARY KEY,
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
@@ -19,9 +30,12 @@ CREATE TABLE IF NOT EXISTS files (
     file_size INTEGER NOT NULL,
     upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     views INTEGER DEFAULT 0,
-    is_public BOOLEAN DEFAULT true
+    is_public BOOLEAN DEFAULT true,
+    content_hash VARCHAR(64) REFERENCES blobs(sha256)
 );
 
+ALTER TABLE files ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64) REFERENCES blobs(sha256);
+
 CREATE TABLE IF NOT EXISTS user_sessions (
     id SERIAL PRIMARY KEY,
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
@@ -46,6 +60,23 @@ CREATE TABLE IF NOT EXISTS user_settings (
     url_length INTEGER DEFAULT 8
 );
 
+CREATE TABLE IF NOT EXISTS cleanup_jobs (
+    id VARCHAR(32) PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS cleanup_queue (
+    id BIGSERIAL PRIMARY KEY,
+    job_id VARCHAR(32) NOT NULL REFERENCES cleanup_jobs(id) ON DELETE CASCADE,
+    storage_key VARCHAR(500) NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+
 CREATE TABLE IF NOT EXISTS file_shares (
     id SERIAL PRIMARY KEY,
     file_id INTEGER REFERENCES files(id) ON DELETE CASCADE,
@@ -56,7 +87,10 @@ CREATE TABLE IF NOT EXISTS file_shares (
 );
 
 CREATE INDEX IF NOT EXISTS idx_files_user_id ON files(user_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_files_filename ON files(filename);
 CREATE INDEX IF NOT EXISTS idx_files_upload_date ON files(upload_date);
+CREATE INDEX IF NOT EXISTS idx_files_user_upload_date ON files(user_id, upload_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files(content_hash);
 CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON user_sessions(user_id);
 CREATE INDEX IF NOT EXISTS idx_sessions_token ON user_sessions(session_token);
 CREATE INDEX IF NOT EXISTS idx_file_shares_token ON file_shares(share_token);
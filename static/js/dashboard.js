@@ -27,16 +27,35 @@ async function checkAuth() {
     }
 }
 
+// Follows the /files cursor until every page has been fetched
+async function fetchAllFiles(token) {
+    let files = [];
+    let cursor = null;
+
+    do {
+        const params = new URLSearchParams({ limit: 1000 });
+        if (cursor) params.set('cursor', cursor);
+
+        const response = await fetch(`${API_URL}/files?${params}`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (!response.ok) return null;
+
+        files = files.concat(await response.json());
+        cursor = response.headers.get('X-Next-Cursor');
+    } while (cursor);
+
+    return files;
+}
+
 async function loadDashboardData() {
     const token = localStorage.getItem('token');
 
     try {
-        const response = await fetch(`${API_URL}/files`, {
-            headers: { 'Authorization': `Bearer ${token}` }
-        });
+        const files = await fetchAllFiles(token);
 
-        if (response.ok) {
-            userFiles = await response.json();
+        if (files) {
+            userFiles = files;
             updateStats(userFiles);
             drawChart(userFiles);
             drawFileTypesChart(userFiles);
@@ -1,6 +1,17 @@
 const API_URL = "http://localhost:8000";
 let allFiles = [];
 let currentFile = null;
+let nextCursor = null;
+let loadingMore = false;
+let filesRequestId = 0;
+
+const PAGE_SIZE = 60;
+const TYPE_FILTERS = {
+    png: ['image/png'],
+    jpg: ['image/jpeg', 'image/jpg'],
+    gif: ['image/gif'],
+    svg: ['image/svg+xml']
+};
 
 async function checkAuth() {
     const token = localStorage.getItem('token');
@@ -28,20 +39,37 @@ async function checkAuth() {
 }
 
 // Load Files
+function buildFilesQuery(cursor) {
+    const params = new URLSearchParams({
+        limit: PAGE_SIZE,
+        sort: document.getElementById('sortSelect').value
+    });
+    const searchTerm = document.getElementById('searchInput').value.trim();
+    if (searchTerm) params.set('q', searchTerm);
+    const types = TYPE_FILTERS[document.getElementById('typeFilter').value] || [];
+    types.forEach(type => params.append('file_type', type));
+    if (cursor) params.set('cursor', cursor);
+    return params;
+}
+
 async function loadFiles() {
     const token = localStorage.getItem('token');
     const filesGrid = document.getElementById('filesGrid');
+    const requestId = ++filesRequestId;
     
     filesGrid.innerHTML = '<div class="loading"><i class="fas fa-spinner"></i> Loading files...</div>';
 
     try {
-        const response = await fetch(`${API_URL}/files`, {
+        const response = await fetch(`${API_URL}/files?${buildFilesQuery()}`, {
             headers: { 'Authorization': `Bearer ${token}` }
         });
+        if (requestId !== filesRequestId) return;
 
         if (response.ok) {
             allFiles = await response.json();
+            nextCursor = response.headers.get('X-Next-Cursor');
             displayFiles(allFiles);
+            maybeLoadMore();
         } else {
             filesGrid.innerHTML = `
                 <div class="empty-state">
@@ -63,6 +91,39 @@ async function loadFiles() {
     }
 }
 
+async function loadMoreFiles() {
+    if (!nextCursor || loadingMore) return;
+
+    const token = localStorage.getItem('token');
+    const requestId = filesRequestId;
+    loadingMore = true;
+
+    try {
+        const response = await fetch(`${API_URL}/files?${buildFilesQuery(nextCursor)}`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (requestId !== filesRequestId || !response.ok) return;
+
+        const page = await response.json();
+        nextCursor = response.headers.get('X-Next-Cursor');
+        allFiles = allFiles.concat(page);
+
+        const filesGrid = document.getElementById('filesGrid');
+        page.forEach(file => filesGrid.appendChild(createFileCard(file)));
+        setTimeout(maybeLoadMore, 0);
+    } catch (error) {
+        console.error('Failed to load more files:', error);
+    } finally {
+        loadingMore = false;
+    }
+}
+
+function maybeLoadMore() {
+    if (nextCursor && window.innerHeight + window.scrollY >= document.body.offsetHeight - 600) {
+        loadMoreFiles();
+    }
+}
+
 function displayFiles(files) {
     const filesGrid = document.getElementById('filesGrid');
     
@@ -99,7 +160,7 @@ function createFileCard(file) {
     card.innerHTML = `
         <div class="file-preview">
             ${isImage 
-                ? `<img src="${API_URL}/raw/${file.filename}" alt="${file.original_name}" class="file-thumbnail" loading="lazy">`
+                ? `<img src="${API_URL}/thumb/${file.filename}" alt="${file.original_name}" class="file-thumbnail" loading="lazy">`
                 : `<i class="fas fa-file file-icon"></i>`
             }
             <div class="file-actions">
@@ -217,57 +278,23 @@ function showNotification(message, type = 'info') {
 }
 
 // Search and Sort
+let searchTimer = null;
+
 document.getElementById('searchInput').addEventListener('input', function() {
-    applyFiltersAndSort();
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(loadFiles, 300);
 });
 
 document.getElementById('sortSelect').addEventListener('change', function() {
-    applyFiltersAndSort();
+    loadFiles();
 });
 
 document.getElementById('typeFilter').addEventListener('change', function() {
-    applyFiltersAndSort();
+    loadFiles();
 });
 
-function applyFiltersAndSort() {
-    const searchTerm = document.getElementById('searchInput').value.toLowerCase();
-    const sortBy = document.getElementById('sortSelect').value;
-    const typeFilter = document.getElementById('typeFilter').value;
-    
-    let filteredFiles = allFiles.filter(file => {
-        const matchesSearch = file.original_name.toLowerCase().includes(searchTerm);
-        const matchesType = typeFilter === 'all' || 
-            (typeFilter === 'png' && file.file_type.includes('png')) ||
-            (typeFilter === 'jpg' && (file.file_type.includes('jpeg') || file.file_type.includes('jpg'))) ||
-            (typeFilter === 'gif' && file.file_type.includes('gif')) ||
-            (typeFilter === 'svg' && file.file_type.includes('svg'));
-        
-        return matchesSearch && matchesType;
-    });
-    
-    switch(sortBy) {
-        case 'newest':
-            filteredFiles.sort((a, b) => new Date(b.upload_date) - new Date(a.upload_date));
-            break;
-        case 'oldest':
-            filteredFiles.sort((a, b) => new Date(a.upload_date) - new Date(b.upload_date));
-            break;
-        case 'largest':
-            filteredFiles.sort((a, b) => b.file_size - a.file_size);
-            break;
-        case 'smallest':
-            filteredFiles.sort((a, b) => a.file_size - b.file_size);
-            break;
-        case 'name':
-            filteredFiles.sort((a, b) => a.original_name.localeCompare(b.original_name));
-            break;
-        case 'type':
-            filteredFiles.sort((a, b) => a.file_type.localeCompare(b.file_type));
-            break;
-    }
-    
-    displayFiles(filteredFiles);
-}
+// Lazy-load the next page when the user nears the bottom of the grid
+window.addEventListener('scroll', maybeLoadMore);
 
 function logout() {
     localStorage.removeItem('token');
@@ -1,5 +1,6 @@
 const API_URL = "http://localhost:8000";
 const MAX_STORAGE_MB = 1000;
+const UPLOAD_BATCH_SIZE = 20;
 
 async function checkAuth() {
     const token = localStorage.getItem('token');
@@ -30,16 +31,35 @@ async function checkAuth() {
 }
 
 
+// Follows the /files cursor until every page has been fetched
+async function fetchAllFiles(token) {
+    let files = [];
+    let cursor = null;
+
+    do {
+        const params = new URLSearchParams({ limit: 1000 });
+        if (cursor) params.set('cursor', cursor);
+
+        const response = await fetch(`${API_URL}/files?${params}`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (!response.ok) return null;
+
+        files = files.concat(await response.json());
+        cursor = response.headers.get('X-Next-Cursor');
+    } while (cursor);
+
+    return files;
+}
+
 async function loadDashboardData() {
     const token = localStorage.getItem('token');
 
     try {
-        const response = await fetch(`${API_URL}/files`, {
-            headers: { 'Authorization': `Bearer ${token}` }
-        });
+        const files = await fetchAllFiles(token);
 
-        if (response.ok) {
-            userFiles = await response.json();
+        if (files) {
+            userFiles = files;
             updateStats(userFiles);
         }
     } catch (error) {
@@ -74,13 +94,13 @@ async function loadStorageInfo() {
     const token = localStorage.getItem('token');
     
     try {
-        const response = await fetch(`${API_URL}/files`, {
+        const response = await fetch(`${API_URL}/storage/usage`, {
             headers: { 'Authorization': `Bearer ${token}` }
         });
         
         if (response.ok) {
-            const files = await response.json();
-            const totalSize = files.reduce((sum, file) => sum + file.file_size, 0);
+            const usage = await response.json();
+            const totalSize = usage.used_bytes;
             const usedMB = (totalSize / (1024 * 1024)).toFixed(2);
             const usedPercentage = (usedMB / MAX_STORAGE_MB) * 100;
             
@@ -144,6 +164,7 @@ async function handleFiles(files) {
     queueContainer.style.display = 'block';
     queueItems.innerHTML = '';
 
+    const pending = [];
     for (let file of files) {
         if (!allowedTypes.includes(file.type)) {
             showNotification(`${file.name}: Unsupported file type`, 'error');
@@ -157,8 +178,16 @@ async function handleFiles(files) {
 
         const queueItem = createQueueItem(file);
         queueItems.appendChild(queueItem);
+        pending.push({ file, queueItem });
+    }
 
-        await uploadFile(file, token, queueItem);
+    for (let i = 0; i < pending.length; i += UPLOAD_BATCH_SIZE) {
+        const batch = pending.slice(i, i + UPLOAD_BATCH_SIZE);
+        if (batch.length === 1) {
+            await uploadFile(batch[0].file, token, batch[0].queueItem);
+        } else {
+            await uploadBatch(batch, token);
+        }
     }
 }
 
@@ -166,13 +195,13 @@ async function getCurrentStorageUsage() {
     const token = localStorage.getItem('token');
     
     try {
-        const response = await fetch(`${API_URL}/files`, {
+        const response = await fetch(`${API_URL}/storage/usage`, {
             headers: { 'Authorization': `Bearer ${token}` }
         });
         
         if (response.ok) {
-            const files = await response.json();
-            return files.reduce((sum, file) => sum + file.file_size, 0);
+            const usage = await response.json();
+            return usage.used_bytes;
         }
     } catch (error) {
         console.error('Failed to get storage usage:', error);
@@ -249,6 +278,63 @@ async function uploadFile(file, token, queueItem) {
     }
 }
 
+function markQueueItem(queueItem, ok) {
+    const progressFill = queueItem.querySelector('.progress-fill');
+    const statusText = queueItem.querySelector('.queue-status');
+
+    if (ok) {
+        progressFill.style.width = '100%';
+        statusText.innerHTML = '<i class="fas fa-check" style="color: var(--success);"></i> Complete';
+        queueItem.style.borderColor = 'var(--success)';
+    } else {
+        statusText.innerHTML = '<i class="fas fa-times" style="color: var(--error);"></i> Failed';
+        queueItem.style.borderColor = 'var(--error)';
+    }
+}
+
+async function uploadBatch(batch, token) {
+    const formData = new FormData();
+    batch.forEach(({ file }) => formData.append('files', file));
+
+    const settings = JSON.parse(localStorage.getItem('customizationSettings') || '{}');
+    const urlLength = settings.urlLength || 8;
+
+    batch.forEach(({ queueItem }) => {
+        queueItem.querySelector('.queue-status').textContent = 'Uploading...';
+    });
+
+    try {
+        const response = await fetch(`${API_URL}/upload/batch`, {
+            method: 'POST',
+            headers: {
+                'Authorization': `Bearer ${token}`,
+                'X-URL-Length': urlLength.toString()
+            },
+            body: formData
+        });
+
+        if (!response.ok) {
+            throw new Error('Upload failed');
+        }
+
+        const result = await response.json();
+        result.files.forEach((entry, i) => {
+            const { queueItem } = batch[i];
+            markQueueItem(queueItem, Boolean(entry.file));
+            if (entry.file) {
+                showUploadSuccess(entry.file.original_name, `http://localhost:8000/img/${entry.file.filename}`);
+            } else {
+                showNotification(`${entry.original_name}: ${entry.error}`, 'error');
+            }
+        });
+        loadStorageInfo();
+    } catch (error) {
+        console.error('Upload error:', error);
+        batch.forEach(({ queueItem }) => markQueueItem(queueItem, false));
+        showNotification('Upload failed', 'error');
+    }
+}
+
 function showUploadSuccess(filename, shareLink) {
     const notification = document.createElement('div');
     notification.className = 'notification success';
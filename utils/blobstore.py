@@ -0,0 +1,198 @@
+import asyncio
+from typing import List, Tuple
+
+import asyncpg
+
+from utils.logger import log
+from utils.storage import StorageBackend
+from utils.uploads import StagedUpload, discard
+
+
+def blob_key(
+        sha256: str
+        ) -> str:
+    """Sharded storage key of a blob: blobs/ab/cd/abcd...."""
+    return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+async def lock_storage_keys(
+        conn: asyncpg.Connection,
+        keys: List[str]
+        ):
+    """Transaction-scoped advisory locks on storage keys.
+
+    store_blob takes the same lock before it (re)creates a blob, so a
+    cleanup batch can never delete an object that an upload of identical
+    content has just brought back. Locks are taken in a fixed order so two
+    batches cannot deadlock.
+    """
+    await conn.execute(
+        """
+        SELECT COUNT(pg_advisory_xact_lock(h))
+          FROM (SELECT DISTINCT hashtext(k) AS h FROM unnest($1::text[]) AS k ORDER BY h) s
+        """,
+        keys,
+    )
+
+
+async def upload_blob(
+        storage: StorageBackend,
+        staged: StagedUpload
+        ) -> Tuple[str, bool]:
+    """Write the object for `staged` ahead of the transaction that references it.
+
+    Keys are content-addressed, so this needs no lock: writing the same bytes
+    twice is harmless, and an existing object is not written again. The
+    staged file is kept for store_blob. Returns the key and whether this call
+    wrote the object; if no blob row ends up referencing it, the caller
+    should queue it for cleanup.
+    """
+    key = blob_key(staged.sha256)
+    if await storage.exists(key):
+        return key, False
+    await storage.put_file(key, staged.path, keep_source=True)
+    return key, True
+
+
+async def store_blob(
+        conn: asyncpg.Connection,
+        storage: StorageBackend,
+        staged: StagedUpload
+        ) -> Tuple[str, bool]:
+    """Take one reference on the blob for `staged`, writing it only if missing.
+
+    Must run inside a transaction: the key's advisory lock and the blob row are
+    held until commit, so neither a concurrent release of the same hash nor a
+    queued cleanup of the key can delete the object underneath us. Call
+    upload_blob first so the object is normally in place already and only a
+    cheap existence check runs under the lock; the write here covers callers
+    that skip it and a cleanup that removed the object in between.
+    Returns the blob's storage key and whether this call wrote the object.
+    """
+    key = blob_key(staged.sha256)
+    await lock_storage_keys(conn, [key])
+    row = await conn.fetchrow(
+        """
+        INSERT INTO blobs (sha256, file_path, file_size)
+        VALUES ($1, $2, $3)
+        ON CONFLICT (sha256) DO UPDATE SET ref_count = blobs.ref_count + 1
+        RETURNING file_path
+        """,
+        staged.sha256,
+        key,
+        staged.size,
+    )
+    key = row["file_path"]
+
+    if not await storage.exists(key):
+        await storage.put_file(key, staged.path)
+        return key, True
+
+    discard(staged.path)
+    return key, False
+
+
+async def store_blobs(
+        conn: asyncpg.Connection,
+        storage: StorageBackend,
+        staged: List[StagedUpload],
+        concurrency: int = 4
+        ) -> List[Tuple[str, bool]]:
+    """store_blob for many uploads at once (duplicates allowed).
+
+    One INSERT takes a reference per entry of `staged`, then objects are
+    checked, and written if missing, up to `concurrency` at a time; with
+    upload_blob run beforehand that is only the existence checks. Returns
+    (key, written) in the order of `staged`; uploads of the same content
+    share a key. If a write fails, the objects this call already wrote are
+    deleted (the key locks are still held) before the error is re-raised.
+    """
+    by_hash = {}
+    for upload in staged:
+        by_hash.setdefault(upload.sha256, []).append(upload)
+    hashes = sorted(by_hash)
+    await lock_storage_keys(conn, [blob_key(h) for h in hashes])
+    rows = await conn.fetch(
+        """
+        INSERT INTO blobs (sha256, file_path, file_size, ref_count)
+        SELECT * FROM unnest($1::text[], $2::text[], $3::bigint[], $4::int[])
+        ON CONFLICT (sha256) DO UPDATE SET ref_count = blobs.ref_count + EXCLUDED.ref_count
+        RETURNING sha256, file_path
+        """,
+        hashes,
+        [blob_key(h) for h in hashes],
+        [by_hash[h][0].size for h in hashes],
+        [len(by_hash[h]) for h in hashes],
+    )
+    rows = {r["sha256"]: r for r in rows}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def place(sha256: str) -> bool:
+        first, *duplicates = by_hash[sha256]
+        for upload in duplicates:
+            discard(upload.path)
+        key = rows[sha256]["file_path"]
+        async with semaphore:
+            if not await storage.exists(key):
+                await storage.put_file(key, first.path)
+                return True
+        discard(first.path)
+        return False
+
+    results = await asyncio.gather(
+        *(place(h) for h in hashes),
+        return_exceptions=True
+        )
+    failed = next((r for r in results if isinstance(r, BaseException)), None)
+    if failed is not None:
+        # Every write has settled, so none is still reading a staged file.
+        for sha256, result in zip(hashes, results):
+            if result is True:
+                try:
+                    await storage.delete(rows[sha256]["file_path"])
+                except Exception as e:
+                    log.warning(f"Could not delete {rows[sha256]['file_path']} after a failed batch: {e}")
+        raise failed
+
+    created = dict(zip(hashes, results))
+    return [(rows[u.sha256]["file_path"], created[u.sha256]) for u in staged]
+
+
+async def release_blobs(
+        conn: asyncpg.Connection,
+        hashes: List[str]
+        ) -> List[str]:
+    """Drop one reference per entry in `hashes` (duplicates allowed).
+
+    Must run inside a transaction. Returns the storage keys of blobs whose
+    last reference went away; their rows are already deleted and the caller
+    should queue the objects for deletion in the same transaction.
+    """
+    hashes = [h for h in hashes if h]
+    if not hashes:
+        return []
+
+    rows = await conn.fetch(
+        """
+        WITH released AS (
+            SELECT h AS sha256, COUNT(*) AS n
+            FROM unnest($1::text[]) AS h
+            GROUP BY h
+        )
+        UPDATE blobs b
+           SET ref_count = b.ref_count - released.n
+          FROM released
+         WHERE b.sha256 = released.sha256
+        RETURNING b.sha256, b.file_path, b.ref_count
+        """,
+        hashes,
+    )
+    orphaned = [r for r in rows if r["ref_count"] <= 0]
+    if not orphaned:
+        return []
+
+    await conn.execute(
+        "DELETE FROM blobs WHERE sha256 = ANY($1::text[])",
+        [r["sha256"] for r in orphaned],
+    )
+    return [r["file_path"] for r in orphaned]
@@ -0,0 +1,86 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Optional
+
+
+class LRUCache:
+    """Bounded in-process LRU cache with a per-entry TTL.
+
+    Not shared between worker processes; rely on the TTL to bound staleness
+    for changes made by another worker.
+    """
+
+    def __init__(
+            self,
+            max_size: int,
+            ttl: float
+            ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(
+            self,
+            key: Hashable
+            ) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(
+            self,
+            key: Hashable,
+            value: Any
+            ):
+        if self.max_size <= 0:
+            return
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(
+            self,
+            key: Hashable
+            ):
+        self._data.pop(key, None)
+
+    def invalidate_many(
+            self,
+            keys: Iterable[Hashable]
+            ):
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
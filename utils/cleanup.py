@@ -0,0 +1,258 @@
+import asyncio
+import secrets
+from typing import List, Optional
+
+import asyncpg
+
+from utils.blobstore import lock_storage_keys, release_blobs
+from utils.config import Cleanup
+from utils.db import Database
+from utils.invalidation import publish_invalidations
+from utils.logger import log
+from utils.storage import StorageBackend
+from utils.thumbnails import remove_variants
+
+
+async def enqueue_cleanup(
+        conn: asyncpg.Connection,
+        user_id: Optional[int],
+        keys: List[str]
+        ) -> Optional[str]:
+    """Queue storage objects for deletion and return the job id.
+
+    Call inside the transaction that deletes the rows referencing them, so
+    the queue entries commit (or roll back) together with the delete.
+    Returns None, and records no job, when there is nothing to delete.
+    """
+    if not keys:
+        return None
+    job_id = secrets.token_hex(16)
+    await conn.execute(
+        "INSERT INTO cleanup_jobs (id, user_id, total) VALUES ($1, $2, $3)",
+        job_id,
+        user_id,
+        len(keys),
+    )
+    await conn.execute(
+        "INSERT INTO cleanup_queue (job_id, storage_key) SELECT $1, unnest($2::text[])",
+        job_id,
+        keys,
+    )
+    return job_id
+
+
+async def prune_cleanup_jobs(
+        conn: asyncpg.Connection,
+        retention_days: int = Cleanup.JOB_RETENTION_DAYS
+        ) -> int:
+    """Delete cleanup jobs that finished more than `retention_days` ago."""
+    result = await conn.execute(
+        "DELETE FROM cleanup_jobs WHERE finished_at < CURRENT_TIMESTAMP - $1 * INTERVAL '1 day'",
+        retention_days,
+    )
+    return int(result.split()[-1])
+
+
+async def delete_file_rows(
+        conn: asyncpg.Connection,
+        user_id: int,
+        files: list
+        ) -> Optional[str]:
+    """Release everything held by deleted `files` rows and queue their objects.
+
+    Runs in the transaction that deleted the rows; the objects themselves are
+    removed by the cleanup worker once it commits, and every worker drops the
+    short names from its cache. Returns the cleanup job id, or None when
+    every blob is still referenced elsewhere.
+    """
+    await publish_invalidations(conn, [f["filename"] for f in files])
+    await conn.execute(
+        "UPDATE users SET storage_used_bytes = GREATEST(storage_used_bytes - $2, 0) WHERE id = $1",
+        user_id,
+        sum(f["file_size"] for f in files),
+    )
+    keys = [f["file_path"] for f in files if not f["content_hash"]]
+    keys += await release_blobs(conn, [f["content_hash"] for f in files])
+    return await enqueue_cleanup(conn, user_id, keys)
+
+
+async def cleanup_progress(
+        conn: asyncpg.Connection,
+        job_id: str,
+        user_id: int
+        ) -> Optional[dict]:
+    row = await conn.fetchrow(
+        "SELECT id, total, done, failed, created_at, finished_at FROM cleanup_jobs WHERE id = $1 AND user_id = $2",
+        job_id,
+        user_id,
+    )
+    if row is None:
+        return None
+    return {
+        "job_id": row["id"],
+        "total": row["total"],
+        "done": row["done"],
+        "failed": row["failed"],
+        "pending": row["total"] - row["done"] - row["failed"],
+        "finished": row["finished_at"] is not None,
+        "created_at": row["created_at"],
+        "finished_at": row["finished_at"],
+    }
+
+
+class CleanupWorker:
+    """Drains cleanup_queue in the background, deleting objects in parallel.
+
+    Every worker process runs one; batches are claimed with SKIP LOCKED so
+    they never overlap. Entries that fail are retried on later passes up to
+    MAX_ATTEMPTS times before being counted as failed.
+    """
+
+    def __init__(
+            self,
+            db: Database,
+            storage: StorageBackend,
+            batch_size: int = Cleanup.BATCH_SIZE,
+            concurrency: int = Cleanup.CONCURRENCY,
+            poll_interval: float = Cleanup.POLL_INTERVAL
+            ):
+        self.db = db
+        self.storage = storage
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self._removed = 0
+        self._skipped = 0
+        self._failures = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def notify(self):
+        """Wake the worker after queueing work in this process."""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                while await self.run_batch():
+                    pass
+            except Exception as e:
+                log.error(f"Storage cleanup failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def remove(
+            self,
+            key: str
+            ):
+        """Delete a stored object and any variants derived from it."""
+        local_path = self.storage.local_path(key)
+        if local_path is not None:
+            await asyncio.to_thread(remove_variants, local_path)
+        await self.storage.delete(key)
+
+    async def _remove_all(
+            self,
+            keys: List[str]
+            ) -> List[bool]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def remove_one(key: str) -> bool:
+            async with semaphore:
+                try:
+                    await self.remove(key)
+                    return True
+                except Exception as e:
+                    log.warning(f"Failed to delete {key}: {e}")
+                    return False
+
+        return await asyncio.gather(*(remove_one(key) for key in keys))
+
+    async def run_batch(self) -> int:
+        """Process one batch; returns how many queue entries it claimed."""
+        async with self.db.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(
+                    """
+                    SELECT id, job_id, storage_key, attempts
+                      FROM cleanup_queue
+                     ORDER BY id
+                     LIMIT $1
+                       FOR UPDATE SKIP LOCKED
+                    """,
+                    self.batch_size,
+                )
+                if not rows:
+                    return 0
+
+                keys = [r["storage_key"] for r in rows]
+                await lock_storage_keys(conn, keys)
+                revived = {
+                    r["file_path"] for r in await conn.fetch(
+                        "SELECT file_path FROM blobs WHERE file_path = ANY($1::text[])",
+                        keys,
+                    )
+                }
+                todo = [r for r in rows if r["storage_key"] not in revived]
+                results = await self._remove_all([r["storage_key"] for r in todo])
+                failed = {r["id"] for r, ok in zip(todo, results) if not ok}
+
+                retry = [r["id"] for r in rows if r["id"] in failed and r["attempts"] + 1 < Cleanup.MAX_ATTEMPTS]
+                finished = [r for r in rows if r["id"] not in retry]
+                await conn.execute(
+                    "UPDATE cleanup_queue SET attempts = attempts + 1 WHERE id = ANY($1::bigint[])",
+                    retry,
+                )
+                await conn.execute(
+                    "DELETE FROM cleanup_queue WHERE id = ANY($1::bigint[])",
+                    [r["id"] for r in finished],
+                )
+                await conn.execute(
+                    """
+                    UPDATE cleanup_jobs AS j
+                       SET done = j.done + v.done,
+                           failed = j.failed + v.failed,
+                           finished_at = CASE
+                               WHEN j.done + v.done + j.failed + v.failed >= j.total THEN CURRENT_TIMESTAMP
+                           END
+                      FROM (
+                            SELECT job_id, COUNT(*) FILTER (WHERE NOT is_failed) AS done,
+                                   COUNT(*) FILTER (WHERE is_failed) AS failed
+                              FROM unnest($1::text[], $2::bool[]) AS t(job_id, is_failed)
+                             GROUP BY job_id
+                           ) v
+                     WHERE j.id = v.job_id
+                    """,
+                    [r["job_id"] for r in finished],
+                    [r["id"] in failed for r in finished],
+                )
+
+        self._removed += len(todo) - len(failed)
+        self._skipped += len(rows) - len(todo)
+        self._failures += len(failed)
+        return len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "removed": self._removed,
+            "skipped_revived": self._skipped,
+            "failures": self._failures,
+        }
@@ -1,11 +1,199 @@
-
+import os
 from collections import namedtuple
 
+from dotenv import load_dotenv
+
+load_dotenv()
 
 
-LoggingConfig = namedtuple("Logging", ["LEVEL", "FORMAT", "DATE_FORMAT"])
+LoggingConfig = namedtuple(
+    "Logging",
+    ["LEVEL", "FORMAT", "DATE_FORMAT", "JSON", "COLOR", "QUEUE_SIZE", "ACCESS_LOG", "ACCESS_SAMPLE_RATE", "ACCESS_SLOW_MS"]
+)
 Logging = LoggingConfig(
-    LEVEL="INFO",  
+    LEVEL=os.getenv("LOG_LEVEL", "INFO"),
     FORMAT="{asctime} [{levelname}] {name}: {message}",
-    DATE_FORMAT="%Y-%m-%d %H:%M:%S"
+    DATE_FORMAT="%Y-%m-%d %H:%M:%S",
+    JSON=os.getenv("LOG_JSON", "false").lower() == "true",
+    COLOR=os.getenv("LOG_COLOR", "true").lower() == "true",  # only applied when stdout is a terminal
+    QUEUE_SIZE=int(os.getenv("LOG_QUEUE_SIZE", "10000")),  # records buffered before new ones are dropped
+    ACCESS_LOG=os.getenv("LOG_ACCESS", "true").lower() == "true",
+    ACCESS_SAMPLE_RATE=float(os.getenv("LOG_ACCESS_SAMPLE_RATE", "1.0")),  # fraction of ordinary requests logged
+    ACCESS_SLOW_MS=float(os.getenv("LOG_ACCESS_SLOW_MS", "1000")),  # always log requests slower than this
+)
+
+DatabaseConfig = namedtuple(
+    "Database",
+    [
+        "MIN_SIZE",
+        "MAX_SIZE",
+        "ACQUIRE_TIMEOUT",
+        "COMMAND_TIMEOUT",
+        "STATEMENT_CACHE_SIZE",
+        "MAX_INACTIVE_LIFETIME",
+    ]
+)
+Database = DatabaseConfig(
+    MIN_SIZE=int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+    MAX_SIZE=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+    ACQUIRE_TIMEOUT=float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "5")),  # seconds
+    COMMAND_TIMEOUT=float(os.getenv("DB_COMMAND_TIMEOUT", "30")),  # seconds
+    STATEMENT_CACHE_SIZE=int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100")),
+    MAX_INACTIVE_LIFETIME=float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300")),  # seconds
+)
+
+UploadsConfig = namedtuple("Uploads", ["CHUNK_SIZE", "MAX_FILE_SIZE_MB", "BATCH_MAX_FILES", "BATCH_CONCURRENCY"])
+Uploads = UploadsConfig(
+    CHUNK_SIZE=int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024))),  # bytes read per iteration
+    MAX_FILE_SIZE_MB=int(os.getenv("UPLOAD_MAX_FILE_SIZE_MB", "10")),  # hard cap over user_settings
+    BATCH_MAX_FILES=int(os.getenv("UPLOAD_BATCH_MAX_FILES", "50")),
+    BATCH_CONCURRENCY=int(os.getenv("UPLOAD_BATCH_CONCURRENCY", "4")),
+)
+
+ViewsConfig = namedtuple("Views", ["FLUSH_INTERVAL", "FLUSH_THRESHOLD"])
+Views = ViewsConfig(
+    FLUSH_INTERVAL=float(os.getenv("VIEWS_FLUSH_INTERVAL", "5")),  # seconds
+    FLUSH_THRESHOLD=int(os.getenv("VIEWS_FLUSH_THRESHOLD", "1000")),  # pending hits before an early flush
+)
+
+CacheConfig = namedtuple("Cache", ["FILES_MAX_ENTRIES", "FILES_TTL", "USERS_MAX_ENTRIES", "USERS_TTL"])
+Cache = CacheConfig(
+    FILES_MAX_ENTRIES=int(os.getenv("CACHE_FILES_MAX_ENTRIES", "10000")),
+    FILES_TTL=float(os.getenv("CACHE_FILES_TTL", "300")),  # seconds
+    USERS_MAX_ENTRIES=int(os.getenv("CACHE_USERS_MAX_ENTRIES", "5000")),
+    USERS_TTL=float(os.getenv("CACHE_USERS_TTL", "30")),  # seconds
+)
+
+ThumbnailsConfig = namedtuple("Thumbnails", ["ENABLED", "WORKERS", "THUMB_WIDTH", "WIDTHS", "FORMATS", "QUALITY"])
+Thumbnails = ThumbnailsConfig(
+    ENABLED=os.getenv("THUMBNAILS_ENABLED", "true").lower() == "true",
+    WORKERS=int(os.getenv("THUMBNAILS_WORKERS", "2")),  # processes per app worker
+    THUMB_WIDTH=int(os.getenv("THUMBNAILS_THUMB_WIDTH", "320")),
+    WIDTHS=tuple(int(w) for w in os.getenv("THUMBNAILS_WIDTHS", "640,1280").split(",") if w),
+    FORMATS=tuple(f for f in os.getenv("THUMBNAILS_FORMATS", "avif,webp").split(",") if f),  # in order of preference
+    QUALITY=int(os.getenv("THUMBNAILS_QUALITY", "80")),
+)
+
+UsageConfig = namedtuple("Usage", ["RECONCILE_INTERVAL", "RECONCILE_BATCH_SIZE"])
+Usage = UsageConfig(
+    RECONCILE_INTERVAL=float(os.getenv("USAGE_RECONCILE_INTERVAL", "3600")),  # seconds, 0 disables
+    RECONCILE_BATCH_SIZE=int(os.getenv("USAGE_RECONCILE_BATCH_SIZE", "500")),  # users per transaction
+)
+
+PasswordsConfig = namedtuple("Passwords", ["WORKERS", "MAX_QUEUE", "BCRYPT_ROUNDS"])
+Passwords = PasswordsConfig(
+    WORKERS=int(os.getenv("PASSWORD_HASH_WORKERS", "4")),
+    MAX_QUEUE=int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64")),  # waiting jobs before shedding with 503
+    BCRYPT_ROUNDS=int(os.getenv("BCRYPT_ROUNDS", "12")),  # work factor for new hashes
+)
+
+ServerConfig = namedtuple(
+    "Server",
+    [
+        "HOST",
+        "PORT",
+        "WORKERS",
+        "LOOP",
+        "HTTP",
+        "BACKLOG",
+        "KEEPALIVE",
+        "GRACEFUL_TIMEOUT",
+        "PROXY_HEADERS",
+        "FORWARDED_ALLOW_IPS",
+        "DB_POOL_TOTAL_MAX_SIZE",
+    ]
+)
+Server = ServerConfig(
+    HOST=os.getenv("HOST", "localhost"),
+    PORT=int(os.getenv("PORT", "8000")),
+    WORKERS=int(os.getenv("WORKERS", "0")),  # 0 = one per CPU core, at most 4
+    LOOP=os.getenv("SERVER_LOOP", "auto"),  # auto picks uvloop when installed
+    HTTP=os.getenv("SERVER_HTTP", "auto"),  # auto picks httptools when installed
+    BACKLOG=int(os.getenv("SERVER_BACKLOG", "2048")),
+    KEEPALIVE=int(os.getenv("SERVER_KEEPALIVE", "5")),  # seconds
+    GRACEFUL_TIMEOUT=int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30")),  # seconds
+    PROXY_HEADERS=os.getenv("SERVER_PROXY_HEADERS", "true").lower() == "true",
+    FORWARDED_ALLOW_IPS=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+    DB_POOL_TOTAL_MAX_SIZE=int(os.getenv("DB_POOL_TOTAL_MAX_SIZE", "40")),  # 0 = DB_POOL_MAX_SIZE per worker
+)
+
+EmbedConfig = namedtuple(
+    "Embed",
+    ["ENABLED", "HOST", "PORT", "ORIGIN", "CACHE_MAX_ENTRIES", "CACHE_TTL", "DB_POOL_MAX_SIZE"]
+)
+Embed = EmbedConfig(
+    ENABLED=os.getenv("EMBED_ENABLED", "true").lower() == "true",
+    HOST=os.getenv("EMBED_HOST", "0.0.0.0"),
+    PORT=int(os.getenv("EMBED_PORT", "8080")),
+    ORIGIN=os.getenv("EMBED_ORIGIN", "http://localhost:8000").rstrip("/"),
+    CACHE_MAX_ENTRIES=int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "10000")),
+    CACHE_TTL=int(os.getenv("EMBED_CACHE_TTL", "300")),  # seconds
+    DB_POOL_MAX_SIZE=int(os.getenv("EMBED_DB_POOL_MAX_SIZE", "4")),
+)
+
+StorageConfig = namedtuple(
+    "Storage",
+    [
+        "BACKEND",
+        "LOCAL_ROOT",
+        "S3_BUCKET",
+        "S3_PREFIX",
+        "S3_ENDPOINT_URL",
+        "S3_REGION",
+        "S3_ACCESS_KEY_ID",
+        "S3_SECRET_ACCESS_KEY",
+        "S3_MAX_POOL_CONNECTIONS",
+        "S3_MULTIPART_THRESHOLD_MB",
+        "S3_PART_SIZE_MB",
+    ]
+)
+Storage = StorageConfig(
+    BACKEND=os.getenv("STORAGE_BACKEND", "local").lower(),  # local | s3
+    LOCAL_ROOT=os.getenv("STORAGE_LOCAL_ROOT", "uploads"),
+    S3_BUCKET=os.getenv("S3_BUCKET", ""),
+    S3_PREFIX=os.getenv("S3_PREFIX", "").strip("/"),
+    S3_ENDPOINT_URL=os.getenv("S3_ENDPOINT_URL") or None,  # e.g. a MinIO server
+    S3_REGION=os.getenv("S3_REGION") or None,
+    S3_ACCESS_KEY_ID=os.getenv("S3_ACCESS_KEY_ID") or None,
+    S3_SECRET_ACCESS_KEY=os.getenv("S3_SECRET_ACCESS_KEY") or None,
+    S3_MAX_POOL_CONNECTIONS=int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32")),
+    S3_MULTIPART_THRESHOLD_MB=int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "16")),
+    S3_PART_SIZE_MB=int(os.getenv("S3_PART_SIZE_MB", "8")),  # S3 minimum is 5
+)
+
+ShortIdsConfig = namedtuple("ShortIds", ["MIN_LENGTH", "MAX_LENGTH", "MAX_ATTEMPTS"])
+ShortIds = ShortIdsConfig(
+    MIN_LENGTH=int(os.getenv("SHORT_ID_MIN_LENGTH", "6")),
+    MAX_LENGTH=int(os.getenv("SHORT_ID_MAX_LENGTH", "32")),
+    MAX_ATTEMPTS=int(os.getenv("SHORT_ID_MAX_ATTEMPTS", "5")),
+)
+
+CleanupConfig = namedtuple("Cleanup", ["BATCH_SIZE", "CONCURRENCY", "POLL_INTERVAL", "MAX_ATTEMPTS", "JOB_RETENTION_DAYS"])
+Cleanup = CleanupConfig(
+    BATCH_SIZE=int(os.getenv("CLEANUP_BATCH_SIZE", "200")),
+    CONCURRENCY=int(os.getenv("CLEANUP_CONCURRENCY", "16")),
+    POLL_INTERVAL=float(os.getenv("CLEANUP_POLL_INTERVAL", "10")),  # seconds
+    MAX_ATTEMPTS=int(os.getenv("CLEANUP_MAX_ATTEMPTS", "5")),
+    JOB_RETENTION_DAYS=int(os.getenv("CLEANUP_JOB_RETENTION_DAYS", "7")),  # finished jobs, pruned by the expiry run
+)
+
+ExpiryConfig = namedtuple("Expiry", ["INTERVAL", "BATCH_SIZE", "MAX_BATCHES"])
+Expiry = ExpiryConfig(
+    INTERVAL=float(os.getenv("EXPIRY_INTERVAL", "900")),  # seconds, 0 disables
+    BATCH_SIZE=int(os.getenv("EXPIRY_BATCH_SIZE", "500")),  # files per transaction
+    MAX_BATCHES=int(os.getenv("EXPIRY_MAX_BATCHES", "100")),  # per run
+)
+
+MetricsConfig = namedtuple("Metrics", ["ENABLED", "LOOP_LAG_INTERVAL", "MAX_STATEMENTS", "TOKEN"])
+Metrics = MetricsConfig(
+    ENABLED=os.getenv("METRICS_ENABLED", "true").lower() == "true",
+    LOOP_LAG_INTERVAL=float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5")),  # seconds, 0 disables
+    MAX_STATEMENTS=int(os.getenv("METRICS_MAX_STATEMENTS", "200")),  # distinct query labels
+    TOKEN=os.getenv("METRICS_TOKEN", ""),  # bearer token for /metrics and /stats; unset hides them
+)
+
+ServeConfig = namedtuple("Serve", ["ACCEL", "ACCEL_PREFIX"])
+Serve = ServeConfig(
+    ACCEL=os.getenv("SERVE_ACCEL", "off").lower(),  # off | x-accel-redirect | x-sendfile
+    ACCEL_PREFIX=os.getenv("SERVE_ACCEL_PREFIX", "/_files").rstrip("/"),  # nginx internal location for STORAGE_LOCAL_ROOT
 )
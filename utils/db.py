@@ -0,0 +1,140 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import asyncpg
+from fastapi import HTTPException
+
+from utils.config import Database as DatabaseSettings
+from utils.logger import log
+
+
+class Database:
+    """Application-wide asyncpg connection pool with acquisition stats."""
+
+    def __init__(self, dsn: str, settings=DatabaseSettings, query_logger=None):
+        self.dsn = dsn
+        self.settings = settings
+        self.query_logger = query_logger
+        self.pool: Optional[asyncpg.Pool] = None
+
+        self._acquired = 0
+        self._waiting = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    async def connect(self):
+        """Create the pool. Called once from the app lifespan."""
+        if self.pool is not None:
+            return
+        self.pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=self.settings.MIN_SIZE,
+            max_size=self.settings.MAX_SIZE,
+            command_timeout=self.settings.COMMAND_TIMEOUT,
+            statement_cache_size=self.settings.STATEMENT_CACHE_SIZE,
+            max_inactive_connection_lifetime=self.settings.MAX_INACTIVE_LIFETIME,
+            init=self._init_connection,
+        )
+        log.info(
+            f"Database pool ready (min={self.settings.MIN_SIZE}, max={self.settings.MAX_SIZE})"
+        )
+
+    async def _init_connection(self, conn: asyncpg.Connection):
+        if self.query_logger is not None:
+            conn.add_query_logger(self.query_logger)
+
+    async def close(self):
+        if self.pool is None:
+            return
+        pool, self.pool = self.pool, None
+        try:
+            await asyncio.wait_for(pool.close(), timeout=self.settings.COMMAND_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning("Database pool did not close in time, terminating connections")
+            pool.terminate()
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Borrow a connection from the pool for the duration of the block."""
+        if self.pool is None:
+            raise HTTPException(
+                status_code=503,
+                detail="Database pool is not initialised"
+            )
+
+        self._waiting += 1
+        started = time.perf_counter()
+        try:
+            conn = await self.pool.acquire(timeout=self.settings.ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Database is busy, try again shortly"
+            )
+        except (OSError, asyncpg.PostgresError) as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Database connection failed. Check POSTGRES env. Error: {e}"
+            )
+        finally:
+            self._waiting -= 1
+
+        waited = time.perf_counter() - started
+        self._acquired += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+
+    @asynccontextmanager
+    async def leader_lock(
+            self,
+            name: str
+            ):
+        """Try to become the only holder of `name` across all workers.
+
+        Yields the connection holding the session-level advisory lock, or
+        None when another process holds it; the lock is released on exit.
+        Background jobs that must run once per cluster wrap each run in it
+        and do their work on that connection, so a run costs one connection.
+        """
+        async with self.acquire() as conn:
+            held = await conn.fetchval(
+                "SELECT pg_try_advisory_lock(hashtext($1))",
+                name
+            )
+            try:
+                yield conn if held else None
+            finally:
+                if held:
+                    await conn.execute(
+                        "SELECT pg_advisory_unlock(hashtext($1))",
+                        name
+                    )
+
+    def stats(self) -> dict:
+        """Snapshot of pool usage for operators."""
+        if self.pool is None:
+            size = idle = 0
+        else:
+            size = self.pool.get_size()
+            idle = self.pool.get_idle_size()
+        return {
+            "min_size": self.settings.MIN_SIZE,
+            "max_size": self.settings.MAX_SIZE,
+            "size": size,
+            "in_use": size - idle,
+            "idle": idle,
+            "waiting": self._waiting,
+            "acquired_total": self._acquired,
+            "acquire_timeouts": self._timeouts,
+            "wait_avg_ms": round(self._wait_total / self._acquired * 1000, 3) if self._acquired else 0.0,
+            "wait_max_ms": round(self._wait_max * 1000, 3),
+        }
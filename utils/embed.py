@@ -0,0 +1,201 @@
+import html
+import threading
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from typing import Optional
+from urllib.parse import quote
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, PlainTextResponse, RedirectResponse, Response
+from starlette.routing import Route
+
+from utils.cache import LRUCache
+from utils.config import Database as DatabaseSettings, Embed
+from utils.db import Database
+from utils.logger import log
+
+
+CRAWLER_AGENTS = (
+    "discordbot",
+    "twitterbot",
+    "facebookexternalhit",
+    "slackbot",
+    "telegrambot",
+    "whatsapp",
+    "linkedinbot",
+    "embedly",
+    "skypeuripreview",
+    "mastodon",
+)
+
+EmbedMeta = namedtuple(
+    "EmbedMeta",
+    ["filename", "original_name", "file_type", "file_size", "embeddable"]
+)
+
+
+def is_crawler(
+        user_agent: str
+        ) -> bool:
+    user_agent = user_agent.lower()
+    return any(bot in user_agent for bot in CRAWLER_AGENTS)
+
+
+def render_embed(
+        meta: EmbedMeta,
+        origin: str
+        ) -> str:
+    """OpenGraph / Twitter card page pointing the crawler at the raw file."""
+    name = quote(meta.filename)
+    page_url = html.escape(f"{origin}/img/{name}")
+    raw_url = html.escape(f"{origin}/raw/{name}")
+    title = html.escape(meta.original_name)
+
+    tags = [
+        '<meta property="og:site_name" content="PixelDust">',
+        f'<meta property="og:title" content="{title}">',
+        f'<meta property="og:url" content="{page_url}">',
+    ]
+    if meta.file_type.startswith("image/"):
+        tags += [
+            '<meta property="og:type" content="website">',
+            f'<meta property="og:image" content="{raw_url}">',
+            f'<meta property="og:image:type" content="{html.escape(meta.file_type)}">',
+            '<meta name="twitter:card" content="summary_large_image">',
+            f'<meta name="twitter:image" content="{raw_url}">',
+        ]
+    elif meta.file_type.startswith("video/"):
+        tags += [
+            '<meta property="og:type" content="video.other">',
+            f'<meta property="og:video" content="{raw_url}">',
+            f'<meta property="og:video:type" content="{html.escape(meta.file_type)}">',
+            '<meta name="twitter:card" content="player">',
+        ]
+    else:
+        tags.append('<meta property="og:type" content="website">')
+
+    return (
+        "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+        f"<title>{title}</title>"
+        + "".join(tags)
+        + f'<meta http-equiv="refresh" content="0; url={page_url}">'
+        "</head><body></body></html>"
+    )
+
+
+class EmbedServer:
+    """Answers link-preview crawlers on a separate port.
+
+    Crawlers get an OpenGraph page built from file metadata; everyone else,
+    and files whose owner turned Discord embeds off, get a redirect to ORIGIN.
+    It runs its own uvicorn server on a background thread of the launcher
+    process, with a small pool and cache of its own, so many slow crawler
+    connections cannot hold up one another or the API workers.
+    """
+
+    def __init__(
+            self,
+            dsn: str,
+            origin: str = Embed.ORIGIN,
+            host: str = Embed.HOST,
+            port: int = Embed.PORT
+            ):
+        self.origin = origin
+        self.host = host
+        self.port = port
+        self.db = Database(
+            dsn,
+            DatabaseSettings._replace(
+                MIN_SIZE=1,
+                MAX_SIZE=max(1, Embed.DB_POOL_MAX_SIZE)
+            )
+        )
+        self.cache = LRUCache(Embed.CACHE_MAX_ENTRIES, Embed.CACHE_TTL)
+        self.app = Starlette(
+            routes=[
+                Route("/img/{filename}", self.embed, methods=["GET", "HEAD"]),
+            ],
+            lifespan=self._lifespan,
+        )
+        self._server: Optional[uvicorn.Server] = None
+
+    @asynccontextmanager
+    async def _lifespan(self, app):
+        await self.db.connect()
+        try:
+            yield
+        finally:
+            await self.db.close()
+
+    async def lookup(
+            self,
+            filename: str
+            ) -> Optional[EmbedMeta]:
+        meta = self.cache.get(filename)
+        if meta is not None:
+            return meta
+
+        async with self.db.acquire() as conn:
+            rec = await conn.fetchrow(
+                """
+                SELECT f.filename, f.original_name, f.file_type, f.file_size,
+                       COALESCE(f.is_public, true) AND COALESCE(s.discord_embed, true) AS embeddable
+                  FROM files f
+                  LEFT JOIN user_settings s ON s.user_id = f.user_id
+                 WHERE f.filename = $1
+                """,
+                filename
+            )
+        if not rec:
+            return None
+        meta = EmbedMeta(**dict(rec))
+        self.cache.set(filename, meta)
+        return meta
+
+    async def embed(self, request: Request) -> Response:
+        filename = request.path_params["filename"]
+        target = f"{self.origin}/img/{quote(filename)}"
+        if not is_crawler(request.headers.get("user-agent", "")):
+            return RedirectResponse(target, status_code=302)
+
+        meta = await self.lookup(filename)
+        if meta is None:
+            return PlainTextResponse("Not found", status_code=404)
+        if not meta.embeddable:
+            return RedirectResponse(target, status_code=302)
+        return HTMLResponse(
+            render_embed(meta, self.origin),
+            headers={"Cache-Control": f"public, max-age={Embed.CACHE_TTL}"}
+        )
+
+    def serve_forever(self):
+        self._server = uvicorn.Server(
+            uvicorn.Config(
+                self.app,
+                host=self.host,
+                port=self.port,
+                lifespan="on",
+                log_level="warning",
+                log_config=None,
+                access_log=False,
+            )
+        )
+        log.info(
+            f"Embed server running on http://{self.host}:{self.port} -> {self.origin}"
+        )
+        self._server.run()
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(
+            target=self.serve_forever,
+            name="embed-server",
+            daemon=True
+        )
+        thread.start()
+        return thread
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
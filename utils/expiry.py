@@ -0,0 +1,139 @@
+import asyncio
+from typing import Callable, Iterable, Optional
+
+import asyncpg
+
+from utils.cleanup import delete_file_rows, prune_cleanup_jobs
+from utils.config import Expiry
+from utils.db import Database
+from utils.logger import log
+
+
+async def expire_batch(
+        conn: asyncpg.Connection,
+        batch_size: int = Expiry.BATCH_SIZE
+        ) -> list:
+    """Delete up to `batch_size` files older than their owner's auto-delete age.
+
+    Rows are picked per user through idx_files_user_upload_date and skipped
+    when a request already holds them. Their storage is released and queued
+    for the cleanup worker in the same transaction. Returns the deleted rows.
+    """
+    async with conn.transaction():
+        files = await conn.fetch(
+            """
+            DELETE FROM files
+             WHERE id IN (
+                    SELECT f.id
+                      FROM user_settings s
+                      JOIN LATERAL (
+                            SELECT id FROM files
+                             WHERE user_id = s.user_id
+                               AND upload_date < CURRENT_TIMESTAMP - s.auto_delete_after_days * INTERVAL '1 day'
+                             ORDER BY upload_date
+                             LIMIT $1
+                               FOR UPDATE SKIP LOCKED
+                           ) f ON true
+                     WHERE s.auto_delete_after_days > 0
+                     LIMIT $1
+                   )
+            RETURNING user_id, filename, file_path, content_hash, file_size
+            """,
+            batch_size,
+        )
+        by_user = {}
+        for f in files:
+            by_user.setdefault(f["user_id"], []).append(f)
+        for user_id in sorted(by_user):
+            await delete_file_rows(conn, user_id, by_user[user_id])
+    return files
+
+
+class ExpiryScheduler:
+    """Enforces user_settings.auto_delete_after_days and prunes old sessions.
+
+    Every worker runs the loop, but each run first takes a cluster-wide
+    advisory lock, so only one of them does the work at a time. A run
+    deletes expired files in batches of EXPIRY_BATCH_SIZE until none are
+    left (at most EXPIRY_MAX_BATCHES), then calls cleanup_old_sessions() and
+    prunes cleanup jobs older than CLEANUP_JOB_RETENTION_DAYS.
+    `on_expired` receives the filenames removed, e.g. to drop cache entries.
+    """
+
+    lock_name = "pixeldust:expiry"
+
+    def __init__(
+            self,
+            db: Database,
+            interval: float = Expiry.INTERVAL,
+            on_expired: Optional[Callable[[Iterable[str]], None]] = None,
+            on_cleanup: Optional[Callable[[], None]] = None
+            ):
+        self.db = db
+        self.interval = interval
+        self.on_expired = on_expired
+        self.on_cleanup = on_cleanup
+        self._task: Optional[asyncio.Task] = None
+
+        self._runs = 0
+        self._skipped = 0
+        self._expired = 0
+        self._pruned_jobs = 0
+        self._failures = 0
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run_once(self) -> Optional[int]:
+        """One expiry pass; None when another worker holds the lock."""
+        async with self.db.leader_lock(self.lock_name) as conn:
+            if conn is None:
+                self._skipped += 1
+                return None
+            expired = 0
+            for _ in range(Expiry.MAX_BATCHES):
+                files = await expire_batch(conn)
+                if not files:
+                    break
+                expired += len(files)
+                if self.on_expired is not None:
+                    self.on_expired(f["filename"] for f in files)
+                if self.on_cleanup is not None:
+                    self.on_cleanup()
+            await conn.execute("SELECT cleanup_old_sessions()")
+            self._pruned_jobs += await prune_cleanup_jobs(conn)
+        self._runs += 1
+        self._expired += expired
+        return expired
+
+    async def _run(self):
+        while True:
+            try:
+                expired = await self.run_once()
+            except Exception as e:
+                self._failures += 1
+                log.error(f"File expiry run failed: {e}")
+            else:
+                if expired:
+                    log.info(f"Expired {expired} file(s) past their auto-delete age")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "runs": self._runs,
+            "skipped_not_leader": self._skipped,
+            "expired_files": self._expired,
+            "pruned_cleanup_jobs": self._pruned_jobs,
+            "failures": self._failures,
+        }
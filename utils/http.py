@@ -0,0 +1,417 @@
+import os
+import secrets
+import stat
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Callable, List, Mapping, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.types import Receive, Scope, Send
+
+
+MAX_RANGES = 16
+
+
+def make_etag(
+        content_hash: Optional[str],
+        size: int,
+        mtime: float,
+        suffix: str = ""
+        ) -> str:
+    """Strong validator: the content hash when known, else size and mtime."""
+    if content_hash:
+        return f'"{content_hash}{suffix}"'
+    return f'"{int(mtime):x}-{size:x}{suffix}"'
+
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+def is_not_modified(
+        headers: Mapping[str, str],
+        etag: str,
+        mtime: float
+        ) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since as in RFC 9110 section 13.2.2.
+
+    If-Modified-Since is ignored whenever If-None-Match is present.
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison: W/"x" matches "x".
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag in candidates
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since is None:
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return int(mtime) <= int(since.timestamp())
+    return False
+
+
+def not_modified_response(
+        etag: str,
+        mtime: float,
+        headers: Optional[Mapping[str, str]] = None
+        ) -> Response:
+    out = dict(headers or {})
+    out["ETag"] = etag
+    out["Last-Modified"] = http_date(mtime)
+    return Response(status_code=304, headers=out)
+
+
+def parse_range(
+        header: str,
+        size: int
+        ) -> Optional[List[Tuple[int, int]]]:
+    """Parse a `Range: bytes=...` header into sorted, merged inclusive ranges.
+
+    Returns None when the header should be ignored (other unit, malformed, or
+    too many ranges) and an empty list when no range is satisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        if not sep:
+            return None
+        try:
+            if not first:
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start, end = max(size - suffix, 0), size - 1
+            else:
+                start = int(first)
+                if last and int(last) < start:
+                    return None
+                end = min(int(last), size - 1) if last else size - 1
+        except ValueError:
+            return None
+        if start < 0 or start >= size:
+            continue
+        ranges.append((start, end))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(
+        if_range: str,
+        etag: Optional[str],
+        last_modified: Optional[str]
+        ) -> bool:
+    """If-Range needs a strong ETag match or an exact Last-Modified match."""
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return etag is not None and not if_range.startswith("W/") and if_range == etag
+    return last_modified is not None and if_range == last_modified
+
+
+async def send_ranges(
+        send: Send,
+        raw_headers: List[Tuple[bytes, bytes]],
+        content_type: str,
+        size: int,
+        ranges: List[Tuple[int, int]],
+        read,
+        head: bool
+        ) -> None:
+    """Send a 206 for `ranges`; `read(start, end)` yields the bytes of one range.
+
+    A single range goes out with Content-Range, several as a
+    multipart/byteranges body.
+    """
+    base_headers = [
+        (k, v) for k, v in raw_headers
+        if k not in (b"content-length", b"content-type")
+    ]
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers = base_headers + [
+            (b"content-type", content_type.encode("latin-1")),
+            (b"content-range", f"bytes {start}-{end}/{size}".encode("latin-1")),
+            (b"content-length", str(end - start + 1).encode("latin-1")),
+        ]
+        parts = [(b"", start, end)]
+        trailer = b""
+    else:
+        boundary = secrets.token_hex(16)
+        parts = [
+            (
+                (f"\r\n--{boundary}\r\n"
+                 f"Content-Type: {content_type}\r\n"
+                 f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode("latin-1"),
+                start,
+                end,
+            )
+            for start, end in ranges
+        ]
+        trailer = f"\r\n--{boundary}--\r\n".encode("latin-1")
+        length = sum(len(part) + end - start + 1 for part, start, end in parts) + len(trailer)
+        headers = base_headers + [
+            (b"content-type", f"multipart/byteranges; boundary={boundary}".encode("latin-1")),
+            (b"content-length", str(length).encode("latin-1")),
+        ]
+
+    await send({"type": "http.response.start", "status": 206, "headers": headers})
+    if not head:
+        for part, start, end in parts:
+            if part:
+                await send({"type": "http.response.body", "body": part, "more_body": True})
+            async for chunk in read(start, end):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": trailer if not head else b"", "more_body": False})
+
+
+def select_ranges(
+        request_headers: Headers,
+        size: int,
+        etag: Optional[str],
+        last_modified: Optional[str]
+        ) -> Optional[List[Tuple[int, int]]]:
+    """Ranges to serve for this request, None for a full response, [] for 416."""
+    range_header = request_headers.get("range")
+    if not range_header:
+        return None
+    if_range = request_headers.get("if-range")
+    if if_range is not None and not if_range_matches(if_range, etag, last_modified):
+        return None
+    return parse_range(range_header, size)
+
+
+def range_not_satisfiable(
+        size: int
+        ) -> Response:
+    return Response(
+        status_code=416,
+        headers={"Content-Range": f"bytes */{size}", "Accept-Ranges": "bytes"},
+    )
+
+
+async def object_missing(
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        on_missing: Optional[Callable[[], None]]
+        ) -> None:
+    """404 for a stored object that disappeared after its metadata was cached."""
+    if on_missing is not None:
+        on_missing()
+    await JSONResponse({"detail": "File not found on disk"}, 404)(scope, receive, send)
+
+
+def content_disposition(filename: str) -> str:
+    """Content-Disposition value matching what FileResponse sends."""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+class RangeFileResponse(FileResponse):
+    """FileResponse that also answers `Range` requests with 206 responses.
+
+    `If-Range` is honoured, and anything that cannot be served as a range
+    falls back to the full FileResponse. A file that is gone by the time the
+    response runs becomes a 404 (after calling `on_missing`) instead of a
+    RuntimeError.
+    """
+
+    def __init__(self, *args, on_missing: Optional[Callable[[], None]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.headers["accept-ranges"] = "bytes"
+        self.on_missing = on_missing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.stat_result is None:
+            try:
+                self.stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+            except FileNotFoundError:
+                return await object_missing(scope, receive, send, self.on_missing)
+            if not stat.S_ISREG(self.stat_result.st_mode):
+                raise RuntimeError(f"File at path {self.path} is not a file.")
+            self.set_stat_headers(self.stat_result)
+
+        request_headers = Headers(scope=scope)
+        if "range" not in request_headers or scope["method"].upper() not in ("GET", "HEAD"):
+            return await super().__call__(scope, receive, send)
+
+        size = self.stat_result.st_size
+        ranges = select_ranges(
+            request_headers, size, self.headers.get("etag"), self.headers.get("last-modified")
+        )
+        if ranges is None:
+            return await super().__call__(scope, receive, send)
+        if not ranges:
+            return await range_not_satisfiable(size)(scope, receive, send)
+
+        async def read(start: int, end: int):
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+        await send_ranges(
+            send,
+            self.raw_headers,
+            self.headers.get("content-type", self.media_type),
+            size,
+            ranges,
+            read,
+            scope["method"].upper() == "HEAD",
+        )
+        if self.background is not None:
+            await self.background()
+
+
+class StorageResponse(Response):
+    """Streams an object from a storage backend, with the same Range handling
+    as RangeFileResponse. Used when the backend has no local file to hand to
+    FileResponse.
+
+    The first chunk is read before the status line is sent, so an object
+    deleted behind a cached lookup still turns into a clean 404.
+    """
+
+    def __init__(
+            self,
+            storage,
+            key: str,
+            size: int,
+            media_type: Optional[str] = None,
+            filename: Optional[str] = None,
+            headers: Optional[Mapping[str, str]] = None,
+            on_missing: Optional[Callable[[], None]] = None
+            ):
+        super().__init__(headers=headers, media_type=media_type)
+        self.storage = storage
+        self.key = key
+        self.size = size
+        self.on_missing = on_missing
+        self.headers["content-length"] = str(size)
+        self.headers["accept-ranges"] = "bytes"
+        if filename is not None:
+            self.headers["content-disposition"] = content_disposition(filename)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        head = scope["method"].upper() == "HEAD"
+        ranges = None
+        if scope["method"].upper() in ("GET", "HEAD"):
+            ranges = select_ranges(
+                Headers(scope=scope), self.size, self.headers.get("etag"), self.headers.get("last-modified")
+            )
+        if ranges == []:
+            return await range_not_satisfiable(self.size)(scope, receive, send)
+
+        first = None
+        if not head:
+            try:
+                first = await self._open(*(ranges[0] if ranges else (0, None)))
+            except FileNotFoundError:
+                return await object_missing(scope, receive, send, self.on_missing)
+
+        if ranges:
+            def read(start: int, end: int):
+                nonlocal first
+                stream, first = first, None
+                return stream or self.storage.get_stream(self.key, start, end)
+
+            await send_ranges(
+                send,
+                self.raw_headers,
+                self.media_type or "application/octet-stream",
+                self.size,
+                ranges,
+                read,
+                head,
+            )
+        else:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if first is not None:
+                async for chunk in first:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if self.background is not None:
+            await self.background()
+
+    async def _open(
+            self,
+            start: int,
+            end: Optional[int]
+            ):
+        """Stream of one range with its first chunk already fetched."""
+        stream = self.storage.get_stream(self.key, start, end)
+        try:
+            head = await stream.__anext__()
+        except StopAsyncIteration:
+            head = b""
+
+        async def chained():
+            if head:
+                yield head
+            async for chunk in stream:
+                yield chunk
+        return chained()
+
+
+class OffloadResponse(Response):
+    """Empty response telling a front proxy which file to send.
+
+    `header` is X-Accel-Redirect (nginx, with an internal location) or
+    X-Sendfile (Apache mod_xsendfile, lighttpd); the proxy then sends the file
+    itself, with sendfile and Range support, so no file bytes pass through
+    Python. nginx only keeps Content-Type, Content-Disposition,
+    Cache-Control, Expires, Accept-Ranges and Set-Cookie from this response;
+    any other header (ETag, Vary, X-Content-Type-Options) has to be added back
+    in the internal location, and responses that depend on Vary should not be
+    offloaded at all.
+    """
+
+    def __init__(
+            self,
+            header: str,
+            target: str,
+            media_type: Optional[str] = None,
+            filename: Optional[str] = None,
+            headers: Optional[Mapping[str, str]] = None
+            ):
+        super().__init__(headers=headers, media_type=media_type)
+        # The proxy supplies the real length; an upstream Content-Length: 0 would confuse it.
+        del self.headers["content-length"]
+        self.headers[header] = target
+        if filename is not None:
+            self.headers["content-disposition"] = content_disposition(filename)
@@ -0,0 +1,128 @@
+import asyncio
+import json
+from typing import Callable, Iterable, List, Optional
+
+import asyncpg
+
+from utils.db import Database
+from utils.logger import log
+
+CHANNEL = "pixeldust_file_cache"
+# Postgres rejects NOTIFY payloads of 8000 bytes or more.
+MAX_PAYLOAD = 7900
+
+
+async def publish_invalidations(
+        conn: asyncpg.Connection,
+        filenames: Iterable[str]
+        ):
+    """Tell every worker to drop `filenames` from its short-link cache.
+
+    Call inside the transaction that deletes the rows: NOTIFY is delivered
+    only once it commits, and not at all if it rolls back.
+    """
+    payloads = []
+    batch: List[str] = []
+    size = 2
+    for name in filenames:
+        entry = len(json.dumps(name)) + 1
+        if batch and size + entry > MAX_PAYLOAD:
+            payloads.append(json.dumps(batch, separators=(",", ":")))
+            batch, size = [], 2
+        batch.append(name)
+        size += entry
+    if batch:
+        payloads.append(json.dumps(batch, separators=(",", ":")))
+    for payload in payloads:
+        await conn.execute("SELECT pg_notify($1, $2)", CHANNEL, payload)
+
+
+class CacheInvalidationListener:
+    """Applies invalidations published by any worker to this worker's cache.
+
+    A LISTEN needs a connection of its own, so this keeps one outside the
+    pool, pings it every `keepalive` seconds and reconnects after `retry`
+    seconds when it is lost. Notifications sent while disconnected are gone,
+    so `on_reset` (e.g. clearing the cache) runs after every reconnect.
+    """
+
+    def __init__(
+            self,
+            db: Database,
+            on_invalidate: Callable[[List[str]], None],
+            on_reset: Callable[[], None],
+            retry: float = 5.0,
+            keepalive: float = 30.0
+            ):
+        self.db = db
+        self.on_invalidate = on_invalidate
+        self.on_reset = on_reset
+        self.retry = retry
+        self.keepalive = keepalive
+        self._task: Optional[asyncio.Task] = None
+
+        self._connects = 0
+        self._received = 0
+        self._failures = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _notified(self, conn, pid, channel, payload):
+        try:
+            filenames = json.loads(payload)
+        except ValueError:
+            log.warning(f"Ignoring malformed cache invalidation: {payload[:100]}")
+            return
+        self._received += 1
+        self.on_invalidate(filenames)
+
+    async def _run(self):
+        while True:
+            try:
+                conn = await asyncpg.connect(self.db.dsn)
+            except Exception as e:
+                self._failures += 1
+                log.warning(f"Cache invalidation listener could not connect: {e}")
+                await asyncio.sleep(self.retry)
+                continue
+
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda c: lost.set())
+            try:
+                await conn.add_listener(CHANNEL, self._notified)
+                if self._connects:
+                    self.on_reset()
+                self._connects += 1
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), timeout=self.keepalive)
+                    except asyncio.TimeoutError:
+                        await conn.fetchval("SELECT 1")
+                self._failures += 1
+                log.warning("Cache invalidation listener lost its connection")
+            except Exception as e:
+                self._failures += 1
+                log.warning(f"Cache invalidation listener lost its connection: {e}")
+            finally:
+                if not conn.is_closed():
+                    conn.terminate()
+            await asyncio.sleep(self.retry)
+
+    def stats(self) -> dict:
+        return {
+            "connects": self._connects,
+            "received": self._received,
+            "failures": self._failures,
+        }
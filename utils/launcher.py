@@ -0,0 +1,111 @@
+import argparse
+import os
+
+import uvicorn
+
+from utils.config import Database, Server
+from utils.logger import log
+
+AUTO_WORKERS_MAX = 4
+# Requests plus the background jobs (expiry, usage, cleanup) each need a
+# connection of their own, so a worker pool never gets fewer than this.
+MIN_WORKER_POOL_SIZE = 2
+
+
+def resolve_workers(
+        workers: int = Server.WORKERS
+        ) -> int:
+    """0 means one worker per CPU core, capped at AUTO_WORKERS_MAX.
+
+    Each worker brings its own DB pool and thumbnail processes, so the
+    automatic count stays small; set WORKERS to go beyond it.
+    """
+    if workers > 0:
+        return workers
+    return min(os.cpu_count() or 1, AUTO_WORKERS_MAX)
+
+
+def size_worker_pools(
+        workers: int,
+        total: int = Server.DB_POOL_TOTAL_MAX_SIZE
+        ):
+    """Keep all workers' pools within DB_POOL_TOTAL_MAX_SIZE connections.
+
+    Every worker opens its own asyncpg pool from DB_POOL_MAX_SIZE, so without
+    a total the database sees workers * DB_POOL_MAX_SIZE connections; with
+    one, each pool gets at most an equal share of it. Workers
+    are spawned processes that read the config on import, which is why the
+    per-worker sizes are handed down through the environment.
+    """
+    if total <= 0:
+        return
+    max_size = max(MIN_WORKER_POOL_SIZE, min(Database.MAX_SIZE, total // workers))
+    if max_size * workers > total:
+        log.warning(
+            f"DB_POOL_TOTAL_MAX_SIZE={total} is too small for {workers} workers; "
+            f"using {max_size} connections each ({max_size * workers} total)"
+        )
+    min_size = min(Database.MIN_SIZE, max_size)
+    os.environ["DB_POOL_MAX_SIZE"] = str(max_size)
+    os.environ["DB_POOL_MIN_SIZE"] = str(min_size)
+    log.info(
+        f"DB pool per worker: {min_size}-{max_size} connections ({max_size * workers} total across {workers} workers)"
+    )
+
+
+def run(
+        host: str = Server.HOST,
+        port: int = Server.PORT,
+        workers: int = Server.WORKERS,
+        reload: bool = False
+        ):
+    """Serve main:app with uvicorn.
+
+    With more than one worker uvicorn runs a supervisor process: SIGHUP
+    restarts the workers one by one to pick up new code, SIGINT/SIGTERM stop
+    accepting connections and give in-flight requests GRACEFUL_TIMEOUT
+    seconds to finish. `reload` is for development and forces one worker.
+    """
+    workers = 1 if reload else resolve_workers(workers)
+    size_worker_pools(workers)
+
+    log.info(
+        f"Starting PixelDust on http://{host}:{port} ({workers} worker{'s' if workers != 1 else ''})"
+    )
+    uvicorn.run(
+        "main:app",
+        host=host,
+        port=port,
+        workers=workers,
+        reload=reload,
+        loop=Server.LOOP,
+        http=Server.HTTP,
+        backlog=Server.BACKLOG,
+        timeout_keep_alive=Server.KEEPALIVE,
+        timeout_graceful_shutdown=Server.GRACEFUL_TIMEOUT,
+        proxy_headers=Server.PROXY_HEADERS,
+        forwarded_allow_ips=Server.FORWARDED_ALLOW_IPS,
+        # uvicorn's records go through our queued root handler, and access
+        # lines come from AccessLogMiddleware instead.
+        log_config=None,
+        access_log=False,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the PixelDust API server.")
+    parser.add_argument("--host", default=Server.HOST, help="bind address (HOST)")
+    parser.add_argument("--port", type=int, default=Server.PORT, help="bind port (PORT)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=Server.WORKERS,
+        help="worker processes, 0 for one per CPU core (WORKERS)"
+    )
+    parser.add_argument("--reload", action="store_true", help="restart on code changes (development)")
+    args = parser.parse_args(argv)
+    run(args.host, args.port, args.workers, args.reload)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,28 @@
+import atexit
+import contextvars
+import json
 import logging
+import queue
+import random
+import re
+import secrets
 import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
 from utils.config import Logging
 
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed through `extra=`.
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
 class ColoredFormatter(logging.Formatter):
     """Custom formatter with colors for different log levels."""
-    
+
     COLORS = {
         'DEBUG': '\033[36m',     # Cyan
         'INFO': '\033[32m',      # Green
@@ -13,34 +31,185 @@ class ColoredFormatter(logging.Formatter):
         'CRITICAL': '\033[35m',  # Magenta
     }
     RESET = '\033[0m'
-    
+
+    def format(self, record):
+        # Color a copy: the record is shared with every other handler.
+        if record.levelname in self.COLORS:
+            record = logging.makeLogRecord(record.__dict__)
+            record.levelname = f"{self.COLORS[record.levelname]}{record.levelname}{self.RESET}"
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with `extra=` fields and the request id."""
+
     def format(self, record):
-        original_levelname = record.levelname
-        if original_levelname in self.COLORS:
-            record.levelname = f"{self.COLORS[original_levelname]}{original_levelname}{self.RESET}"
-        formatted = super().format(record)
-        record.levelname = original_levelname 
-        return formatted
+        entry = {
+            "ts": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the id of the request being handled, if any.
+
+    Runs in the thread that logged, before the record is queued, so the
+    context variable is still the caller's.
+    """
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Like QueueHandler.prepare, but keep the traceback separate from the
+        # message so the JSON formatter can put it in its own field.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _formatter() -> logging.Formatter:
+    if Logging.JSON:
+        return JsonFormatter(datefmt=Logging.DATE_FORMAT)
+    if Logging.COLOR and sys.stdout.isatty():
+        return ColoredFormatter(fmt=Logging.FORMAT, datefmt=Logging.DATE_FORMAT, style='{')
+    return logging.Formatter(fmt=Logging.FORMAT, datefmt=Logging.DATE_FORMAT, style='{')
+
 
 def setup_logger():
-    """Setup the logger with the configuration from utils.config."""
+    """Setup the logger with the configuration from utils.config.
+
+    Log calls only put the record on a bounded queue; a QueueListener thread
+    formats it and writes to stdout, so a slow stdout pipe cannot block the
+    event loop. Records are dropped (and counted) if the queue fills up.
+    """
     logger = logging.getLogger()
-    logger.setLevel(getattr(logging, Logging.LEVEL.upper(), logging.INFO))
+    level = getattr(logging, Logging.LEVEL.upper(), logging.INFO)
+    logger.setLevel(level)
 
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
-    
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setLevel(getattr(logging, Logging.LEVEL.upper(), logging.INFO))
-    
-    formatter = ColoredFormatter(
-        fmt=Logging.FORMAT,
-        datefmt=Logging.DATE_FORMAT,
-        style='{'
-    )
-    handler.setFormatter(formatter)
+        if isinstance(handler, DroppingQueueHandler) and handler.listener is not None:
+            handler.listener.stop()
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setLevel(level)
+    stream.setFormatter(_formatter())
+
+    handler = DroppingQueueHandler(queue.Queue(Logging.QUEUE_SIZE))
+    handler.addFilter(RequestContextFilter())
+    handler.listener = QueueListener(handler.queue, stream, respect_handler_level=True)
+    handler.listener.start()
+    atexit.register(handler.listener.stop)
 
     logger.addHandler(handler)
     return logger
 
+
+class AccessLogMiddleware:
+    """Pure ASGI middleware assigning request ids and writing access logs.
+
+    The id comes from a well-formed incoming X-Request-ID header or is
+    generated, is echoed back on the response and attached to every record
+    logged while the request runs. Only LOG_ACCESS_SAMPLE_RATE of ordinary
+    requests are logged; errors and requests slower than LOG_ACCESS_SLOW_MS
+    always are.
+    """
+
+    def __init__(
+            self,
+            app,
+            sample_rate: float = Logging.ACCESS_SAMPLE_RATE,
+            slow_ms: float = Logging.ACCESS_SLOW_MS
+            ):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.logger = logging.getLogger("pixeldust.access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                incoming = value.decode("latin-1")
+                break
+        request_id = incoming if incoming and _REQUEST_ID.match(incoming) else secrets.token_hex(8)
+        token = request_id_var.set(request_id)
+
+        started = time.perf_counter()
+        status = 500
+        sent = 0
+
+        async def send_with_id(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            latency_ms = (time.perf_counter() - started) * 1000
+            if status >= 500 or latency_ms >= self.slow_ms or random.random() < self.sample_rate:
+                client = scope.get("client")
+                self.logger.info(
+                    f'{scope["method"]} {scope["path"]} {status} {latency_ms:.1f}ms',
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status": status,
+                        "latency_ms": round(latency_ms, 3),
+                        "bytes": sent,
+                        "client": client[0] if client else None,
+                    }
+                )
+            request_id_var.reset(token)
+
+
+def stats() -> dict:
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            return {"queued": handler.queue.qsize(), "dropped": handler.dropped}
+    return {"queued": 0, "dropped": 0}
+
+
 log = setup_logger()
@@ -0,0 +1,301 @@
+import asyncio
+import os
+import re
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.config import Metrics as MetricsSettings
+from utils.logger import log
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class Histogram:
+    """Fixed-bucket histogram.
+
+    Every update happens on the event loop thread, so plain integers are
+    enough and no lock is taken on the hot path.
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(
+            self,
+            buckets: Tuple[float, ...]
+            ):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(
+            self,
+            value: float
+            ):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class MetricsRegistry:
+    """Counters and histograms of one worker process, in Prometheus text format.
+
+    Hot-path instruments (requests, queries, loop lag) are recorded as they
+    happen; everything the service already counts elsewhere (pool, caches,
+    background jobs) is read from `collectors` at scrape time instead.
+    Each worker process keeps its own registry.
+    """
+
+    def __init__(
+            self,
+            max_statements: int = MetricsSettings.MAX_STATEMENTS
+            ):
+        self.max_statements = max_statements
+        self.started = time.time()
+
+        self.in_flight = 0
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.request_bytes: Dict[str, int] = {}
+        self.response_bytes: Dict[str, int] = {}
+
+        self.queries: Dict[str, Histogram] = {}
+        self.query_errors: Dict[str, int] = {}
+
+        self.loop_lag = Histogram(LAG_BUCKETS)
+        self._lag_task: Optional[asyncio.Task] = None
+
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, dict, float]]]] = []
+
+    # Requests
+
+    def observe_request(
+            self,
+            method: str,
+            route: str,
+            status: int,
+            elapsed: float,
+            received: int,
+            sent: int
+            ):
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        hist = self.latency.get((method, route))
+        if hist is None:
+            hist = self.latency[(method, route)] = Histogram(LATENCY_BUCKETS)
+        hist.observe(elapsed)
+        if received:
+            self.request_bytes[route] = self.request_bytes.get(route, 0) + received
+        if sent:
+            self.response_bytes[route] = self.response_bytes.get(route, 0) + sent
+
+    # Database
+
+    def statement_label(
+            self,
+            query: str
+            ) -> str:
+        statement = _WHITESPACE.sub(" ", query).strip()[:160]
+        if statement in self.queries or len(self.queries) < self.max_statements:
+            return statement
+        return "other"
+
+    def observe_query(
+            self,
+            record
+            ):
+        """asyncpg query logger; see Connection.add_query_logger."""
+        statement = self.statement_label(record.query)
+        hist = self.queries.get(statement)
+        if hist is None:
+            hist = self.queries[statement] = Histogram(QUERY_BUCKETS)
+        hist.observe(record.elapsed)
+        if record.exception is not None:
+            self.query_errors[statement] = self.query_errors.get(statement, 0) + 1
+
+    # Event loop
+
+    def start(self):
+        if MetricsSettings.LOOP_LAG_INTERVAL > 0 and self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._measure_lag())
+
+    async def stop(self):
+        if self._lag_task is None:
+            return
+        self._lag_task.cancel()
+        try:
+            await self._lag_task
+        except asyncio.CancelledError:
+            pass
+        self._lag_task = None
+
+    async def _measure_lag(self):
+        interval = MetricsSettings.LOOP_LAG_INTERVAL
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(0.0, loop.time() - expected))
+
+    # Exposition
+
+    def render(self) -> str:
+        out: List[str] = []
+
+        def header(name: str, kind: str, help_text: str):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+
+        def histogram(name: str, hist: Histogram, **labels):
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.counts):
+                cumulative += count
+                out.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+            out.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {hist.count}")
+            out.append(f"{name}_sum{_labels(**labels)} {hist.sum}")
+            out.append(f"{name}_count{_labels(**labels)} {hist.count}")
+
+        header("pixeldust_process_start_time_seconds", "gauge", "Start time of this worker process.")
+        out.append(f"pixeldust_process_start_time_seconds{_labels(pid=os.getpid())} {self.started}")
+
+        header("pixeldust_http_requests_in_flight", "gauge", "Requests currently being handled.")
+        out.append(f"pixeldust_http_requests_in_flight {self.in_flight}")
+
+        header("pixeldust_http_requests_total", "counter", "Requests handled, by route and status.")
+        for (method, route, status), count in self.requests.items():
+            out.append(f"pixeldust_http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+
+        header("pixeldust_http_request_duration_seconds", "histogram", "Time to the end of the response body.")
+        for (method, route), hist in self.latency.items():
+            histogram("pixeldust_http_request_duration_seconds", hist, method=method, route=route)
+
+        header("pixeldust_http_request_bytes_total", "counter", "Request body bytes received (uploads).")
+        for route, count in self.request_bytes.items():
+            out.append(f"pixeldust_http_request_bytes_total{_labels(route=route)} {count}")
+
+        header("pixeldust_http_response_bytes_total", "counter", "Response body bytes sent.")
+        for route, count in self.response_bytes.items():
+            out.append(f"pixeldust_http_response_bytes_total{_labels(route=route)} {count}")
+
+        header("pixeldust_db_query_duration_seconds", "histogram", "Query time as seen by asyncpg, by statement.")
+        for statement, hist in self.queries.items():
+            histogram("pixeldust_db_query_duration_seconds", hist, statement=statement)
+
+        header("pixeldust_db_query_errors_total", "counter", "Queries that raised, by statement.")
+        for statement, count in self.query_errors.items():
+            out.append(f"pixeldust_db_query_errors_total{_labels(statement=statement)} {count}")
+
+        header("pixeldust_event_loop_lag_seconds", "histogram", "How late the event loop woke a periodic sleeper.")
+        histogram("pixeldust_event_loop_lag_seconds", self.loop_lag)
+
+        seen = set()
+        for collect in self.collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                log.warning(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, labels, value in samples:
+                if name not in seen:
+                    seen.add(name)
+                    out.append(f"# TYPE {name} {kind}")
+                out.append(f"{name}{_labels(**labels)} {value}")
+
+        out.append("")
+        return "\n".join(out)
+
+
+def stats_collector(
+        prefix: str,
+        stats: Callable[[], dict],
+        **labels
+        ) -> Callable[[], Iterable[Tuple[str, str, dict, float]]]:
+    """Expose the numeric fields of a component's stats() as gauges.
+
+    Nested dicts are flattened into the name, e.g. pixeldust_db_wait_max_ms.
+    """
+    def collect():
+        pending = [(f"pixeldust_{prefix}", stats())]
+        while pending:
+            name, values = pending.pop()
+            for key, value in values.items():
+                if isinstance(value, dict):
+                    pending.append((f"{name}_{key}", value))
+                elif isinstance(value, (int, float)):
+                    yield f"{name}_{key}", "gauge", labels, float(value)
+    return collect
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing every HTTP request into a registry.
+
+    The route label is the matched path template (e.g. /img/{filename}), so
+    the number of series stays bounded; unmatched paths share one label.
+    """
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            registry: MetricsRegistry
+            ):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        registry = self.registry
+        started = time.perf_counter()
+        status = 500
+        received = 0
+        sent = 0
+
+        async def counting_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message: Message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        registry.in_flight += 1
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            registry.in_flight -= 1
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            registry.observe_request(
+                scope["method"],
+                route,
+                status,
+                time.perf_counter() - started,
+                received,
+                sent
+            )
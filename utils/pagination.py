@@ -0,0 +1,50 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Tuple
+
+
+# sort name -> (column, direction, column type)
+FILE_SORTS = {
+    "newest": ("upload_date", "DESC", datetime),
+    "oldest": ("upload_date", "ASC", datetime),
+    "largest": ("file_size", "DESC", int),
+    "smallest": ("file_size", "ASC", int),
+    "name": ("original_name", "ASC", str),
+    "type": ("file_type", "ASC", str),
+}
+
+
+def encode_cursor(
+        sort: str,
+        key: Any,
+        row_id: int
+        ) -> str:
+    """Opaque keyset cursor pointing just past the row (key, row_id)."""
+    if isinstance(key, datetime):
+        key = key.isoformat()
+    raw = json.dumps([sort, key, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(
+        cursor: str,
+        sort: str
+        ) -> Tuple[Any, int]:
+    """Inverse of encode_cursor. Raises ValueError on a malformed cursor or one
+    issued for a different sort order."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, key, row_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Malformed cursor") from e
+
+    if cursor_sort != sort:
+        raise ValueError("Cursor does not match the requested sort order")
+
+    key_type = FILE_SORTS[sort][2]
+    if key_type is datetime and isinstance(key, str):
+        key = datetime.fromisoformat(key)
+    if not isinstance(key, key_type) or isinstance(key, bool) or not isinstance(row_id, int):
+        raise ValueError("Malformed cursor")
+    return key, row_id
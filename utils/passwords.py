@@ -0,0 +1,113 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from utils.config import Passwords
+
+
+def build_context(
+        rounds: int = Passwords.BCRYPT_ROUNDS
+        ) -> CryptContext:
+    try:
+        return CryptContext(
+            schemes=["bcrypt", "sha256_crypt"],
+            deprecated="auto",
+            bcrypt__rounds=rounds,
+        )
+    except Exception:
+        return CryptContext(
+            schemes=["sha256_crypt"],
+            deprecated="auto",
+        )
+
+
+class PasswordHasher:
+    """Runs password hashing and verification on a small dedicated thread pool.
+
+    bcrypt releases the GIL while it works, so a few threads keep the event
+    loop free without the overhead of a process pool. Once MAX_QUEUE jobs are
+    queued or running, new ones are rejected with 503 rather than piling up
+    behind a login burst.
+    """
+
+    def __init__(
+            self,
+            workers: int = Passwords.WORKERS,
+            max_queue: int = Passwords.MAX_QUEUE,
+            context: CryptContext = None
+            ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.context = context or build_context()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="password-hash"
+        )
+
+        self._queued = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+        self._wait_max = 0.0
+
+    async def _submit(self, fn, *args):
+        if self._queued >= self.max_queue:
+            self._rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many authentication requests, try again shortly",
+                headers={"Retry-After": "1"}
+            )
+
+        submitted = time.perf_counter()
+        self._queued += 1
+
+        def job():
+            started = time.perf_counter()
+            return fn(*args), started, time.perf_counter()
+
+        try:
+            result, started, finished = await asyncio.get_running_loop().run_in_executor(
+                self._executor, job
+            )
+        finally:
+            self._queued -= 1
+
+        waited = started - submitted
+        self._completed += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        self._run_total += finished - started
+        return result
+
+    async def hash(
+            self,
+            password: str
+            ) -> str:
+        return await self._submit(self.context.hash, password)
+
+    async def verify(
+            self,
+            password: str,
+            hashed: str
+            ) -> bool:
+        return await self._submit(self.context.verify, password, hashed)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        done = self._completed
+        return {
+            "workers": self.workers,
+            "queued": self._queued,
+            "completed": done,
+            "rejected": self._rejected,
+            "wait_avg_ms": round(self._wait_total / done * 1000, 3) if done else 0.0,
+            "wait_max_ms": round(self._wait_max * 1000, 3),
+            "run_avg_ms": round(self._run_total / done * 1000, 3) if done else 0.0,
+        }
@@ -0,0 +1,113 @@
+import secrets
+import string
+from typing import Awaitable, Callable, List, Optional
+
+import asyncpg
+from fastapi import HTTPException
+
+from utils.config import ShortIds
+
+
+ALPHABET = string.ascii_letters + string.digits
+
+
+def generate(
+        length: int
+        ) -> str:
+    return "".join(secrets.choice(ALPHABET) for _ in range(length))
+
+
+class ShortIdAllocator:
+    """Hands out public short names that are unique by construction.
+
+    Names come from `secrets` and are never shorter than MIN_LENGTH. The
+    unique index on the target column is the source of truth: each attempt
+    inserts inside a savepoint, and a unique violation on that index just
+    means "try again", one character longer so that a crowded keyspace at
+    the requested length costs at most a few round trips.
+    """
+
+    def __init__(
+            self,
+            constraint: str = "idx_files_filename",
+            min_length: int = ShortIds.MIN_LENGTH,
+            max_length: int = ShortIds.MAX_LENGTH,
+            max_attempts: int = ShortIds.MAX_ATTEMPTS
+            ):
+        self.constraint = constraint
+        self.min_length = min_length
+        self.max_length = max_length
+        self.max_attempts = max_attempts
+
+        self._allocated = 0
+        self._collisions = 0
+        self._exhausted = 0
+
+    def clamp(
+            self,
+            length: Optional[int]
+            ) -> int:
+        return min(max(length or self.min_length, self.min_length), self.max_length)
+
+    async def insert(
+            self,
+            conn: asyncpg.Connection,
+            insert: Callable[[str], Awaitable],
+            length: Optional[int] = None,
+            suffix: str = ""
+            ):
+        """Call `insert(name)` with fresh names until one is not taken.
+
+        Must run inside a transaction; a collision only rolls back its own
+        savepoint. Returns whatever `insert` returned.
+        """
+        return await self.insert_many(
+            conn,
+            lambda names: insert(names[0]),
+            [suffix],
+            length
+        )
+
+    async def insert_many(
+            self,
+            conn: asyncpg.Connection,
+            insert: Callable[[List[str]], Awaitable],
+            suffixes: List[str],
+            length: Optional[int] = None
+            ):
+        """Like `insert`, with one name per suffix handed over as a list.
+
+        A collision on any name retries the whole list, since a multi-row
+        INSERT succeeds or fails as a unit.
+        """
+        length = self.clamp(length)
+        for attempt in range(self.max_attempts):
+            size = min(length + attempt, self.max_length)
+            names = []
+            while len(names) < len(suffixes):
+                name = generate(size) + suffixes[len(names)]
+                if name not in names:
+                    names.append(name)
+            try:
+                async with conn.transaction():
+                    result = await insert(names)
+            except asyncpg.UniqueViolationError as e:
+                if e.constraint_name != self.constraint:
+                    raise
+                self._collisions += 1
+                continue
+            self._allocated += len(names)
+            return result
+
+        self._exhausted += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Could not allocate a file name, try again"
+        )
+
+    def stats(self) -> dict:
+        return {
+            "allocated": self._allocated,
+            "collisions": self._collisions,
+            "exhausted": self._exhausted,
+        }
@@ -0,0 +1,363 @@
+import asyncio
+import os
+from collections import namedtuple
+from contextlib import AsyncExitStack
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+import aiofiles
+
+from utils.config import Storage, Uploads
+from utils.logger import log
+from utils.uploads import discard
+
+try:
+    from aiobotocore.session import get_session
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # only needed for STORAGE_BACKEND=s3
+    get_session = None
+
+
+StorageStat = namedtuple("StorageStat", ["size", "mtime"])
+
+
+class StorageBackend:
+    """Where file contents live, addressed by the key kept in files.file_path.
+
+    `get_stream` yields the bytes of `key` from `start` to `end` inclusive
+    (the whole object by default), which is also how ranges are read; it
+    raises FileNotFoundError when the object does not exist.
+    `put_file` takes ownership of a staged local file: it is moved or
+    uploaded into place and is gone afterwards, unless `keep_source` is set.
+    """
+
+    name = "base"
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def local_path(
+            self,
+            key: str
+            ) -> Optional[Path]:
+        """Filesystem path of `key` when the backend is local disk, else None."""
+        return None
+
+    async def put_file(
+            self,
+            key: str,
+            source: Path,
+            keep_source: bool = False
+            ):
+        raise NotImplementedError
+
+    def get_stream(
+            self,
+            key: str,
+            start: int = 0,
+            end: Optional[int] = None,
+            chunk_size: int = Uploads.CHUNK_SIZE
+            ) -> AsyncIterator[bytes]:
+        raise NotImplementedError
+
+    async def read_range(
+            self,
+            key: str,
+            start: int,
+            end: int
+            ) -> bytes:
+        return b"".join([chunk async for chunk in self.get_stream(key, start, end)])
+
+    async def delete(
+            self,
+            key: str
+            ):
+        raise NotImplementedError
+
+    async def stat(
+            self,
+            key: str
+            ) -> Optional[StorageStat]:
+        raise NotImplementedError
+
+    async def exists(
+            self,
+            key: str
+            ) -> bool:
+        return await self.stat(key) is not None
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class LocalStorage(StorageBackend):
+    """Files under a root directory; keys are paths relative to it.
+
+    Rows written before keys existed hold the full path including the root
+    (e.g. "uploads/abc.png"), and those resolve to themselves.
+    """
+
+    name = "local"
+
+    def __init__(
+            self,
+            root: Path
+            ):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def local_path(
+            self,
+            key: str
+            ) -> Path:
+        path = Path(key)
+        if path.is_absolute() or path.parts[:len(self.root.parts)] == self.root.parts:
+            return path
+        return self.root / path
+
+    async def put_file(
+            self,
+            key: str,
+            source: Path,
+            keep_source: bool = False
+            ):
+        dest = self.local_path(key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        # Staging happens inside the root, so this is a rename (or a hard
+        # link when the source is kept), not a copy.
+        if not keep_source:
+            os.replace(source, dest)
+            return
+        try:
+            os.link(source, dest)
+        except FileExistsError:
+            pass  # keys are content-addressed: same bytes already in place
+
+    async def get_stream(
+            self,
+            key: str,
+            start: int = 0,
+            end: Optional[int] = None,
+            chunk_size: int = Uploads.CHUNK_SIZE
+            ) -> AsyncIterator[bytes]:
+        async with aiofiles.open(self.local_path(key), "rb") as f:
+            if start:
+                await f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = await f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    async def delete(
+            self,
+            key: str
+            ):
+        await asyncio.to_thread(self.local_path(key).unlink, missing_ok=True)
+
+    async def stat(
+            self,
+            key: str
+            ) -> Optional[StorageStat]:
+        try:
+            st = os.stat(self.local_path(key))
+        except OSError:
+            return None
+        return StorageStat(st.st_size, st.st_mtime)
+
+
+class S3Storage(StorageBackend):
+    """Objects in an S3-compatible bucket (AWS, MinIO, R2, ...) via aiobotocore.
+
+    One client is shared by the whole process; its connection pool holds up
+    to S3_MAX_POOL_CONNECTIONS keep-alive connections. Files above
+    S3_MULTIPART_THRESHOLD_MB are uploaded in S3_PART_SIZE_MB parts, so only
+    one part is held in memory at a time.
+    """
+
+    name = "s3"
+
+    def __init__(
+            self,
+            bucket: str = Storage.S3_BUCKET,
+            prefix: str = Storage.S3_PREFIX
+            ):
+        if get_session is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the aiobotocore package")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = f"{prefix}/" if prefix else ""
+        self.multipart_threshold = Storage.S3_MULTIPART_THRESHOLD_MB * 1024 * 1024
+        self.part_size = max(Storage.S3_PART_SIZE_MB, 5) * 1024 * 1024
+
+        self._client = None
+        self._stack: Optional[AsyncExitStack] = None
+
+        self._puts = 0
+        self._multipart_puts = 0
+        self._gets = 0
+        self._deletes = 0
+        self._errors = 0
+
+    async def start(self):
+        if self._client is not None:
+            return
+        self._stack = AsyncExitStack()
+        self._client = await self._stack.enter_async_context(
+            get_session().create_client(
+                "s3",
+                endpoint_url=Storage.S3_ENDPOINT_URL,
+                region_name=Storage.S3_REGION,
+                aws_access_key_id=Storage.S3_ACCESS_KEY_ID,
+                aws_secret_access_key=Storage.S3_SECRET_ACCESS_KEY,
+                config=BotoConfig(
+                    max_pool_connections=Storage.S3_MAX_POOL_CONNECTIONS,
+                    retries={"max_attempts": 3, "mode": "standard"},
+                    # Self-hosted endpoints rarely have per-bucket DNS.
+                    s3={"addressing_style": "path"} if Storage.S3_ENDPOINT_URL else None,
+                ),
+            )
+        )
+        log.info(f"S3 storage ready (bucket={self.bucket}, prefix={self.prefix or '/'})")
+
+    async def stop(self):
+        if self._stack is None:
+            return
+        stack, self._stack, self._client = self._stack, None, None
+        await stack.aclose()
+
+    def _key(
+            self,
+            key: str
+            ) -> str:
+        return self.prefix + key
+
+    async def put_file(
+            self,
+            key: str,
+            source: Path,
+            keep_source: bool = False
+            ):
+        size = os.path.getsize(source)
+        if size < self.multipart_threshold:
+            data = await asyncio.to_thread(Path(source).read_bytes)
+            await self._client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+            self._puts += 1
+        else:
+            await self._put_multipart(key, source)
+            self._multipart_puts += 1
+        if not keep_source:
+            discard(source)
+
+    async def _put_multipart(
+            self,
+            key: str,
+            source: Path
+            ):
+        upload = await self._client.create_multipart_upload(Bucket=self.bucket, Key=self._key(key))
+        upload_id = upload["UploadId"]
+        parts = []
+        try:
+            async with aiofiles.open(source, "rb") as f:
+                while True:
+                    chunk = await f.read(self.part_size)
+                    if not chunk:
+                        break
+                    number = len(parts) + 1
+                    resp = await self._client.upload_part(
+                        Bucket=self.bucket,
+                        Key=self._key(key),
+                        UploadId=upload_id,
+                        PartNumber=number,
+                        Body=chunk,
+                    )
+                    parts.append({"PartNumber": number, "ETag": resp["ETag"]})
+            await self._client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self._key(key),
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            self._errors += 1
+            try:
+                await self._client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=self._key(key), UploadId=upload_id
+                )
+            except Exception as e:
+                log.warning(f"Could not abort multipart upload of {key}: {e}")
+            raise
+
+    async def get_stream(
+            self,
+            key: str,
+            start: int = 0,
+            end: Optional[int] = None,
+            chunk_size: int = Uploads.CHUNK_SIZE
+            ) -> AsyncIterator[bytes]:
+        kwargs = {}
+        if start or end is not None:
+            kwargs["Range"] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            resp = await self._client.get_object(Bucket=self.bucket, Key=self._key(key), **kwargs)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(key) from e
+            self._errors += 1
+            raise
+        self._gets += 1
+        async with resp["Body"] as body:
+            while True:
+                chunk = await body.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    async def delete(
+            self,
+            key: str
+            ):
+        await self._client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        self._deletes += 1
+
+    async def stat(
+            self,
+            key: str
+            ) -> Optional[StorageStat]:
+        try:
+            resp = await self._client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            self._errors += 1
+            raise
+        return StorageStat(resp["ContentLength"], resp["LastModified"].timestamp())
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "bucket": self.bucket,
+            "puts": self._puts,
+            "multipart_puts": self._multipart_puts,
+            "gets": self._gets,
+            "deletes": self._deletes,
+            "errors": self._errors,
+        }
+
+
+def create_storage(
+        backend: str = Storage.BACKEND
+        ) -> StorageBackend:
+    if backend == "local":
+        return LocalStorage(Path(Storage.LOCAL_ROOT))
+    if backend == "s3":
+        return S3Storage()
+    raise RuntimeError(f"Unknown STORAGE_BACKEND {backend!r} (expected 'local' or 's3')")
@@ -0,0 +1,258 @@
+import asyncio
+import glob
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from utils.config import Thumbnails
+from utils.logger import log
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it originals are served as-is
+    Image = None
+
+try:
+    import pillow_avif  # noqa: F401  registers AVIF on Pillow builds without it
+except ImportError:
+    pass
+
+
+# source mime type -> format used for the fallback variant
+RASTER_TYPES = {
+    "image/png": "png",
+    "image/jpeg": "jpeg",
+    "image/jpg": "jpeg",
+    "image/gif": "png",
+}
+MEDIA_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+
+
+def available_formats() -> Tuple[str, ...]:
+    """Configured modern formats that this Pillow build can encode."""
+    if Image is None:
+        return ()
+    Image.init()
+    return tuple(f for f in Thumbnails.FORMATS if f.upper() in Image.SAVE)
+
+
+def variant_path(
+        source,
+        width: int,
+        fmt: str
+        ) -> Path:
+    """Derived files live next to the original: <name>.w320.webp"""
+    source = Path(source)
+    ext = "jpg" if fmt == "jpeg" else fmt
+    return source.with_name(f"{source.name}.w{width}.{ext}")
+
+
+def remove_variants(source):
+    """Unlink every derived file of `source`."""
+    source = Path(source)
+    for path in source.parent.glob(f"{glob.escape(source.name)}.w*"):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _render(
+        source: str,
+        base_format: str,
+        widths: Tuple[int, ...],
+        formats: Tuple[str, ...],
+        thumb_width: int,
+        quality: int
+        ) -> int:
+    """Write all variants of one image. Runs in a worker process."""
+    with Image.open(source) as im:
+        animated = getattr(im, "is_animated", False)
+        im.seek(0)
+        frame = ImageOps.exif_transpose(im)
+
+    has_alpha = frame.mode in ("RGBA", "LA", "PA") or "transparency" in frame.info
+    if frame.mode not in ("RGB", "RGBA"):
+        frame = frame.convert("RGBA" if has_alpha else "RGB")
+
+    jobs = []
+    for width in sorted(set(widths) | {thumb_width}):
+        # Animated GIFs keep their animation at full size; only the static
+        # thumbnail is derived. Never upscale past the original width.
+        if width != thumb_width and (animated or width >= frame.width):
+            continue
+        for fmt in formats + (base_format,):
+            jobs.append((width, fmt))
+
+    # The base-format thumbnail is written last and doubles as the marker
+    # that this source has been fully processed.
+    marker = (thumb_width, base_format)
+    jobs.remove(marker)
+    jobs.append(marker)
+
+    resized = {}
+    for width, fmt in jobs:
+        if width not in resized:
+            img = frame.copy()
+            img.thumbnail((width, frame.height), Image.LANCZOS)
+            resized[width] = img
+        img = resized[width]
+        if fmt == "jpeg" and img.mode != "RGB":
+            img = img.convert("RGB")
+
+        dest = variant_path(source, width, fmt)
+        tmp = dest.with_name(dest.name + ".tmp")
+        img.save(tmp, format=fmt.upper(), quality=quality)
+        os.replace(tmp, dest)
+    return len(jobs)
+
+
+class ThumbnailPipeline:
+    """Generates resized and re-encoded variants of uploads in a process pool."""
+
+    MAX_FAILED = 10000
+
+    def __init__(
+            self,
+            workers: int = Thumbnails.WORKERS
+            ):
+        self.workers = workers
+        self.enabled = Thumbnails.ENABLED and Image is not None
+        self.formats = available_formats()
+        self.widths = tuple(sorted(set(Thumbnails.WIDTHS) | {Thumbnails.THUMB_WIDTH}))
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._failed = set()
+
+        self._completed = 0
+        self._failures = 0
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # spawn rather than fork: the parent has a running event loop and threads.
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def start(self):
+        if not self.enabled or self._pool is not None:
+            return
+        self._pool = self._new_pool()
+        log.info(
+            f"Thumbnail pipeline ready ({self.workers} workers, formats: {', '.join(self.formats) or 'none'})"
+        )
+
+    async def stop(self):
+        if self._pool is None:
+            return
+        pool, self._pool = self._pool, None
+        for future in list(self._in_flight.values()):
+            future.cancel()
+        await asyncio.to_thread(pool.shutdown, wait=True, cancel_futures=True)
+
+    def is_ready(
+            self,
+            source,
+            file_type: str
+            ) -> bool:
+        base = RASTER_TYPES.get(file_type)
+        return base is not None and variant_path(source, Thumbnails.THUMB_WIDTH, base).exists()
+
+    def submit(
+            self,
+            source,
+            file_type: str
+            ) -> bool:
+        """Queue variant generation for `source`.
+
+        Returns True while variants are (or will soon be) on their way, False
+        when none will be produced for this file.
+        """
+        base = RASTER_TYPES.get(file_type)
+        key = str(source)
+        if self._pool is None or base is None or key in self._failed:
+            return False
+        if key in self._in_flight:
+            return True
+        if self.is_ready(source, file_type):
+            return False
+
+        future = asyncio.get_running_loop().run_in_executor(
+            self._pool,
+            _render,
+            key,
+            base,
+            self.widths,
+            self.formats,
+            Thumbnails.THUMB_WIDTH,
+            Thumbnails.QUALITY,
+        )
+        self._in_flight[key] = future
+        future.add_done_callback(lambda f: self._on_done(key, f))
+        return True
+
+    def _on_done(
+            self,
+            key: str,
+            future: asyncio.Future
+            ):
+        self._in_flight.pop(key, None)
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if exc is None:
+            self._completed += 1
+            return
+        self._failures += 1
+        if isinstance(exc, BrokenProcessPool):
+            # A worker died (e.g. OOM on a huge image); every pending job on
+            # this pool is lost, so start a fresh one for later submissions.
+            if self._pool is not None and self._pool._broken:
+                self._pool.shutdown(wait=False)
+                self._pool = self._new_pool()
+        if len(self._failed) >= self.MAX_FAILED:
+            self._failed.clear()
+        self._failed.add(key)
+        log.warning(f"Thumbnail generation failed for {key}: {exc}")
+
+    def pick_variant(
+            self,
+            source,
+            file_type: str,
+            width: int,
+            accept: str
+            ) -> Optional[Tuple[Path, str]]:
+        """Best existing variant at least `width` wide that the client accepts.
+
+        Returns (path, media type), or None when the original should be served.
+        """
+        base = RASTER_TYPES.get(file_type)
+        if base is None:
+            return None
+        formats = [f for f in self.formats if MEDIA_TYPES[f] in accept] + [base]
+        for candidate in self.widths:
+            if candidate < width:
+                continue
+            for fmt in formats:
+                path = variant_path(source, candidate, fmt)
+                if path.exists():
+                    return path, MEDIA_TYPES[fmt]
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled and self._pool is not None,
+            "formats": list(self.formats),
+            "in_flight": len(self._in_flight),
+            "completed": self._completed,
+            "failed": self._failures,
+        }
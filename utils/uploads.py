@@ -0,0 +1,123 @@
+import hashlib
+import os
+import tempfile
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict
+
+import aiofiles
+from fastapi import UploadFile
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.config import Uploads
+
+
+StagedUpload = namedtuple("StagedUpload", ["path", "size", "sha256"])
+
+# Room for multipart boundaries and part headers on top of the file bytes.
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class FileTooLarge(Exception):
+    """Raised when an upload exceeds its byte limit while streaming."""
+
+    def __init__(self, limit: int):
+        super().__init__(f"Upload exceeds {limit} bytes")
+        self.limit = limit
+
+
+def discard(path: Path):
+    """Remove a staged file, ignoring it if it is already gone."""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+async def stream_to_temp(
+        source: UploadFile,
+        directory: Path,
+        max_bytes: int,
+        chunk_size: int = Uploads.CHUNK_SIZE
+        ) -> StagedUpload:
+    """Copy an upload into a temp file in `directory` one chunk at a time.
+
+    The size and SHA-256 are computed as the bytes go past, and the copy
+    stops with FileTooLarge once more than `max_bytes` have been read. By
+    then the form parser has already received the whole part; the request
+    body itself is bounded by UploadLimitMiddleware.
+    """
+    if source.size is not None and source.size > max_bytes:
+        raise FileTooLarge(max_bytes)
+
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".part")
+    os.close(fd)
+    tmp_path = Path(tmp_name)
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while True:
+                chunk = await source.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise FileTooLarge(max_bytes)
+                digest.update(chunk)
+                await out.write(chunk)
+    except BaseException:
+        discard(tmp_path)
+        raise
+
+    return StagedUpload(tmp_path, size, digest.hexdigest())
+
+
+
+class UploadLimitMiddleware:
+    """Pure ASGI middleware bounding request bodies on the upload routes.
+
+    FastAPI parses a multipart form, spooling every file to disk, before the
+    handler runs, so limits checked in the handler come too late to stop an
+    oversized body. `limits` maps a path to its byte limit: a Content-Length
+    over it is answered with 413 before anything is read, and a body that
+    grows past it (chunked, or an understated length) fails with 413 as soon
+    as the limit is crossed.
+    """
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            limits: Dict[str, int]
+            ):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Request body too large. Maximum is {limit} bytes"
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                await JSONResponse({"detail": detail}, 413)(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI re-raises HTTPExceptions from body parsing as-is.
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
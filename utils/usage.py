@@ -0,0 +1,113 @@
+import asyncio
+from typing import Optional
+
+import asyncpg
+
+from utils.config import Usage
+from utils.db import Database
+from utils.logger import log
+
+
+async def reconcile_storage_usage(
+        conn: asyncpg.Connection,
+        batch_size: int = Usage.RECONCILE_BATCH_SIZE
+        ) -> int:
+    """Recompute users.storage_used_bytes from files, one batch of users at a time.
+
+    Each batch locks its users rows first. Uploads and deletes update the
+    counter under the same row lock in the transaction that changes files, so
+    the sum read afterwards cannot race with them. Returns the number of users
+    whose counter had drifted.
+    """
+    repaired = 0
+    last_id = 0
+    while True:
+        async with conn.transaction():
+            ids = await conn.fetch(
+                "SELECT id FROM users WHERE id > $1 ORDER BY id LIMIT $2 FOR UPDATE",
+                last_id,
+                batch_size,
+            )
+            if not ids:
+                return repaired
+            ids = [r["id"] for r in ids]
+            result = await conn.execute(
+                """
+                UPDATE users u
+                   SET storage_used_bytes = t.total
+                  FROM (
+                        SELECT u2.id, COALESCE(SUM(f.file_size), 0) AS total
+                          FROM users u2
+                          LEFT JOIN files f ON f.user_id = u2.id
+                         WHERE u2.id = ANY($1::int[])
+                         GROUP BY u2.id
+                       ) t
+                 WHERE u.id = t.id
+                   AND u.storage_used_bytes <> t.total
+                """,
+                ids,
+            )
+        repaired += int(result.split()[-1])
+        last_id = ids[-1]
+
+
+class UsageReconciler:
+    """Periodically repairs drift in the per-user storage counters.
+
+    Runs are serialized across workers with an advisory lock.
+    """
+
+    def __init__(
+            self,
+            db: Database,
+            interval: float = Usage.RECONCILE_INTERVAL
+            ):
+        self.db = db
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+        self._runs = 0
+        self._repaired = 0
+        self._skipped = 0
+        self._failures = 0
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                # One worker reconciles per interval; the others skip the run.
+                async with self.db.leader_lock("pixeldust:usage") as conn:
+                    repaired = await reconcile_storage_usage(conn) if conn is not None else None
+            except Exception as e:
+                self._failures += 1
+                log.error(f"Storage usage reconciliation failed: {e}")
+            else:
+                if repaired is None:
+                    self._skipped += 1
+                else:
+                    self._runs += 1
+                    self._repaired += repaired
+                    if repaired:
+                        log.warning(f"Repaired storage usage counters for {repaired} user(s)")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "runs": self._runs,
+            "repaired_users": self._repaired,
+            "skipped_not_leader": self._skipped,
+            "failures": self._failures,
+        }
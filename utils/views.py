@@ -0,0 +1,113 @@
+import asyncio
+from typing import Dict, Optional
+
+from utils.config import Views
+from utils.db import Database
+from utils.logger import log
+
+
+class ViewCounter:
+    """Write-behind aggregator for files.views.
+
+    Serve endpoints call hit() which only bumps an in-memory counter; a
+    background task folds the pending increments into a single UPDATE every
+    FLUSH_INTERVAL seconds, or sooner once FLUSH_THRESHOLD hits are pending.
+    """
+
+    def __init__(
+            self,
+            db: Database,
+            interval: float = Views.FLUSH_INTERVAL,
+            threshold: int = Views.FLUSH_THRESHOLD
+            ):
+        self.db = db
+        self.interval = interval
+        self.threshold = threshold
+
+        self._pending: Dict[int, int] = {}
+        self._pending_hits = 0
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+        self._flushes = 0
+        self._flushed_hits = 0
+        self._failures = 0
+
+    def hit(
+            self,
+            file_id: int
+            ):
+        self._pending[file_id] = self._pending.get(file_id, 0) + 1
+        self._pending_hits += 1
+        if self._pending_hits >= self.threshold:
+            self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and write out whatever is still pending.
+
+        The task is asked to exit rather than cancelled, so a flush already
+        in progress finishes instead of dropping the batch it swapped out.
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                break
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        hits, self._pending_hits = self._pending_hits, 0
+
+        # Sorted ids keep row lock order stable across workers flushing at once.
+        ids = sorted(batch)
+        try:
+            async with self.db.acquire() as conn:
+                await conn.execute(
+                    """
+                    UPDATE files AS f
+                       SET views = f.views + v.n
+                      FROM unnest($1::int[], $2::int[]) AS v(id, n)
+                     WHERE f.id = v.id
+                    """,
+                    ids,
+                    [batch[i] for i in ids],
+                )
+        except Exception as e:
+            self._failures += 1
+            log.error(f"Failed to flush {hits} view(s), will retry: {e}")
+            for file_id, n in batch.items():
+                self._pending[file_id] = self._pending.get(file_id, 0) + n
+            self._pending_hits += hits
+            return
+
+        self._flushes += 1
+        self._flushed_hits += hits
+
+    def stats(self) -> dict:
+        return {
+            "pending_files": len(self._pending),
+            "pending_hits": self._pending_hits,
+            "flushes": self._flushes,
+            "flushed_hits": self._flushed_hits,
+            "flush_failures": self._failures,
+        }
@@ -0,0 +1,98 @@
+import io
+import os
+import time
+import zipfile
+from pathlib import PurePath
+from typing import AsyncIterator, Iterable, Tuple
+
+from utils.storage import StorageBackend
+
+
+# ZIP timestamps start in 1980; 1980-01-02 keeps local time past it in any zone.
+_ZIP_EPOCH = 315619200
+
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable write target that hands back whatever has been written.
+
+    Because it cannot seek, ZipFile writes sizes and CRCs into data
+    descriptors after each member instead of patching local headers, which
+    is what lets the archive be produced front to back.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _unique_arcname(
+        name: str,
+        seen: set
+        ) -> str:
+    # Keep only the base name so a stored original_name cannot climb out of
+    # the extraction directory, and number duplicates instead of shadowing.
+    name = PurePath(name.replace("\\", "/")).name or "file"
+    candidate, n = name, 1
+    stem, suffix = os.path.splitext(name)
+    while candidate in seen:
+        candidate = f"{stem} ({n}){suffix}"
+        n += 1
+    seen.add(candidate)
+    return candidate
+
+
+async def stream_zip(
+        entries: Iterable[Tuple[str, str, bool]],
+        storage: StorageBackend,
+        chunk_size: int = 64 * 1024
+        ) -> AsyncIterator[bytes]:
+    """Yield a ZIP archive of (storage key, arcname, compress) entries chunk by chunk.
+
+    Missing objects are skipped. Entries are stored as-is unless `compress` is
+    set, since re-deflating already compressed images only costs CPU. Object
+    bytes are pulled from the storage backend's stream, so memory stays
+    bounded by `chunk_size` whichever backend holds the files.
+    """
+    sink = _ChunkSink()
+    seen = set()
+    with zipfile.ZipFile(sink, mode="w", allowZip64=True) as zf:
+        for key, arcname, compress in entries:
+            st = await storage.stat(key)
+            if st is None:
+                continue
+            info = zipfile.ZipInfo(
+                _unique_arcname(arcname, seen),
+                time.localtime(max(st.mtime, _ZIP_EPOCH))[:6]
+            )
+            info.external_attr = 0o644 << 16
+            info.file_size = st.size
+            info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+            force_zip64 = st.size > zipfile.ZIP64_LIMIT
+
+            with zf.open(info, "w", force_zip64=force_zip64) as dst:
+                async for chunk in storage.get_stream(key, chunk_size=chunk_size):
+                    dst.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()